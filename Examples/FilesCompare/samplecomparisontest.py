@@ -1,5 +1,13 @@
 """Example for Comparison module."""
-from imgqa import Compare
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from imgqa import Compare, comparison, screenshots, tablediff
+from imgqa.screenshots import ScreenshotWriter
 
 # Variable Stack / Data
 image1 = "Examples/FilesCompare/highway.jpg"
@@ -23,20 +31,334 @@ class TestCompareFiles(Compare):
         """Compare images."""
         self.assertEqual(self.compare_images(image1, image1), 1.0)
 
+    def test_compare_image(self):
+        """Compare images without a test case."""
+        result = comparison.compare_image(image1, image2)
+        self.assertEqual(result['score'],
+                         self.compare_images(image1, image2))
+        self.assertFalse(result['cached'])
+
+    def test_compare_image_batch(self):
+        """Compare image pairs in a process pool."""
+        results = self.compare_image_batch(
+            [(image1, image1), (image1, "missing.jpg")], processes=2)
+        self.assertEqual(results['score'][0], 1.0)
+        self.assertIn("missing.jpg", results['error'][1])
+
+    def test_compare_image_cache(self):
+        """Compare images twice through the content hash cache."""
+        cache_dir = tempfile.mkdtemp()
+        try:
+            first = self.compare_image_batch(
+                [(image1, image2)], processes=1, cache_dir=cache_dir)
+            second = self.compare_image_batch(
+                [(image1, image2)], processes=1, cache_dir=cache_dir)
+        finally:
+            shutil.rmtree(cache_dir)
+        self.assertFalse(first['cached'][0])
+        self.assertTrue(second['cached'][0])
+        self.assertEqual(first['score'][0], second['score'][0])
+
+    def test_compare_images_prefilter(self):
+        """Skip SSIM for identical images."""
+        results = self.compare_image_batch(
+            [(image1, image1), (image1, image2)], processes=1,
+            prefilter=True, hash_method='phash')
+        self.assertEqual(results['tier'][0], 'exact')
+        self.assertIn(results['tier'][1], ('hash', 'ssim'))
+
+    def test_compare_images_tiles(self):
+        """Compare images tile by tile and fail fast."""
+        result = self.compare_images(
+            image1, image2, details=True, tile_size=256, fail_below=0.9,
+            exclude=[(0, 0, 256, 256)])
+        self.assertIsNone(result['heatmap'][0][0])
+        self.assertLess(result['score'], 0.9)
+        self.assertIsNotNone(result['failed_tile'])
+
+    def test_compare_images_pyramid(self):
+        """Decide identical images at a coarse scale."""
+        result = self.compare_images(
+            image1, image1, details=True, scales=[0.125, 0.25])
+        self.assertEqual(result['tier'], 'pyramid')
+        self.assertEqual(result['level'], 0.125)
+
+    def test_compare_images_pyramid_resized(self):
+        """Decide a target of another resolution at a coarse scale."""
+        source = screenshots.decode(open(image1, 'rb').read())
+        target = source[::2, ::2].copy()
+        target[:200, :200] = 0
+        result = self.compare_images(
+            source, target, details=True, scales=[0.125],
+            exclude=[(0, 0, 400, 400)])
+        self.assertEqual(result['tier'], 'pyramid')
+        self.assertGreaterEqual(result['score'], 0.99)
+
+    def test_compare_images_diff(self):
+        """Return changed regions and write the annotated diff."""
+        diff_dir = tempfile.mkdtemp()
+        try:
+            result = self.compare_images(
+                image1, image2, details=True, scales=[0.25],
+                fail_below=0.9, diff_dir=diff_dir)
+            self.assertTrue(os.path.exists(result['diff_path']))
+        finally:
+            shutil.rmtree(diff_dir)
+        self.assertTrue(result['boxes'])
+        self.assertEqual(result['ssim_map'].shape, (3840, 2160))
+
+    def test_compare_images_in_memory(self):
+        """Compare encoded and decoded images held in memory."""
+        with open(image1, 'rb') as handle:
+            data = handle.read()
+        writer = ScreenshotWriter(queue_size=1)
+        out_dir = tempfile.mkdtemp()
+        try:
+            path = writer.write(os.path.join(out_dir, 'capture.jpg'), data)
+            writer.close()
+            self.assertEqual(self.compare_images(
+                data, screenshots.decode(data), prefilter=True), 1.0)
+            self.assertEqual(self.compare_images(image1, path), 1.0)
+        finally:
+            shutil.rmtree(out_dir)
+
     def test_compare_jsons(self):
         """Compare jsons."""
         self.assertNotEqual(self.compare_json(source_json, target_json), '{}')
 
+    def test_compare_jsons_stream(self):
+        """Compare json files as streams of parser events."""
+        temp_dir = tempfile.mkdtemp()
+        source = os.path.join(temp_dir, "source.json")
+        target = os.path.join(temp_dir, "target.json")
+        with open(source, "w") as handle:
+            handle.write('{"a": {"b": [1, 2], "c": 3}, "d": "x"}')
+        with open(target, "w") as handle:
+            handle.write('{"a": {"b": [1, 5], "c": 3}, "e": "x"}')
+        try:
+            patches = list(self.compare_json(source, target, stream=True))
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(patches, [
+            {'op': 'replace', 'path': '/a/b/1', 'old': 2, 'value': 5},
+            {'op': 'add', 'path': '/e', 'value': 'x'},
+            {'op': 'remove', 'path': '/d', 'old': 'x'}])
+
+    def test_compare_jsons_keyed(self):
+        """Compare json arrays of records on their identity key."""
+        source = {'items': [{'id': 1, 'qty': 2}, {'id': 2, 'qty': 1}]}
+        target = {'items': [{'id': 3, 'qty': 1}, {'id': 1, 'qty': 5}]}
+        patches = self.compare_json(source, target, keys=['items[*].id'])
+        self.assertEqual(patches, [
+            {'op': 'add', 'path': '/items/[id=3]',
+             'value': {'id': 3, 'qty': 1}},
+            {'op': 'replace', 'path': '/items/[id=1]/qty', 'old': 2,
+             'value': 5},
+            {'op': 'remove', 'path': '/items/[id=2]',
+             'old': {'id': 2, 'qty': 1}}])
+        patches = self.compare_json({'items': [{'sku': '1'}]},
+                                    {'items': [{'sku': '1/2'}]},
+                                    keys=['items[*].sku'])
+        self.assertEqual([patch['path'] for patch in patches],
+                         ['/items/[sku="1~12"]', '/items/[sku="1"]'])
+
+    def test_compare_json_dirs(self):
+        """Compare golden json files with actual captures."""
+        golden_dir = tempfile.mkdtemp()
+        actual_dir = tempfile.mkdtemp()
+        files = {"same.json": ('{"a": 1, "b": 2}', '{"b": 2, "a": 1}'),
+                 "changed.json": ('{"a": 1}', '{"a": 2}')}
+        for name, (golden, actual) in files.items():
+            with open(os.path.join(golden_dir, name), "w") as handle:
+                handle.write(golden)
+            with open(os.path.join(actual_dir, name), "w") as handle:
+                handle.write(actual)
+        with open(os.path.join(golden_dir, "missing.json"), "w") as handle:
+            handle.write('{}')
+        try:
+            results = self.compare_json_dirs(golden_dir, actual_dir,
+                                             processes=2)
+            streamed = self.compare_json_dirs(golden_dir, actual_dir,
+                                              processes=1, stream=True)
+        finally:
+            shutil.rmtree(golden_dir)
+            shutil.rmtree(actual_dir)
+        self.assertTrue(results['identical']['same.json'])
+        self.assertEqual(results['changes']['changed.json'], 1)
+        self.assertIn("No actual file", results['error']['missing.json'])
+        # Loaded and streamed files give the same patches.
+        self.assertEqual(streamed['patches'].tolist(),
+                         results['patches'].tolist())
+        self.assertEqual(results['patches']['changed.json'], [
+            {'op': 'replace', 'path': '/a', 'old': 1, 'value': 2}])
+
     def test_compare_workbooks(self):
         """Compare spreadsheet.
 
         xl file will be generated with file difference.
         """
-        self.compare_files(source_xl, target_xl)
+        result = self.compare_files(source_xl, target_xl)
+        os.remove(result['changed'])
+        self.assertEqual(sorted(self.sheet_timings['Sheet1']),
+                         ['diff', 'read', 'write'])
+
+    def test_compare_workbooks_report(self):
+        """Report changed cells of every row, nothing removed or added."""
+        result = self.compare_files(source_xl, target_xl, sink='memory')
+        changed = result['changed']
+        self.assertEqual(changed['has_change'].tolist(),
+                         ['Yes', 'No', 'No'] + ['Yes'] * 21)
+        self.assertEqual(changed['name'][0],
+                         'Bruen Group ---> Bruen and Jones Group')
+        self.assertEqual(changed['street'][1],
+                         '839 Lana Expressway Suite 234')
+        self.assertEqual(changed['account number'][3],
+                         '296620 ---> 132971')
+        self.assertEqual(changed['postal code'][22], 'nan ---> 64318')
+        self.assertTrue(result['removed'].empty)
+        self.assertTrue(result['added'].empty)
+
+    def test_compare_workbooks_sheets(self):
+        """Diff the sheets of a workbook in order across processes."""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for side in ('source', 'target'):
+                path = os.path.join(temp_dir, side + '.xlsx')
+                with pd.ExcelWriter(path) as writer:
+                    for sheet in ('one', 'two', 'three'):
+                        name = sheet + ('!' if side == 'target' and
+                                        sheet == 'two' else '')
+                        pd.DataFrame({'account number': [1, 2],
+                                      'name': ['a', name]}).to_excel(
+                            writer, sheet_name=sheet, index=False)
+                paths.append(path)
+            result = self.compare_files(paths[0], paths[1], sink='memory',
+                                        processes=2)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(list(self.sheet_timings), ['one', 'two', 'three'])
+        self.assertEqual(
+            [result[sheet + ' changed']['has_change'].tolist()
+             for sheet in ('one', 'two', 'three')],
+            [['No', 'No'], ['No', 'Yes'], ['No', 'No']])
 
     def test_compare_files(self):
         """Compare spreadsheet.
 
         xl file will be generated with file difference.
         """
-        self.compare_files(source_csv, target_csv)
+        result = self.compare_files(source_csv, target_csv)
+        os.remove(result['difference'])
+
+    def test_compare_files_keyed(self):
+        """Compare csv files row by row on a key column."""
+        temp_dir = tempfile.mkdtemp()
+        source = os.path.join(temp_dir, "source.csv")
+        target = os.path.join(temp_dir, "target.csv")
+        with open(source, "w") as handle:
+            handle.write("id,name,price\n1,pen,10\n2,ink,5\n3,cap,2\n")
+        with open(target, "w") as handle:
+            handle.write("id,name,price\n1,pen,12\n2,ink,5\n4,nib,1\n")
+        try:
+            result = self.compare_files(source, target, keys=['id'])
+            files = self.compare_files(source, target, keys=['id'],
+                                       sink='csv')
+            with open(files['removed']) as handle:
+                removed = handle.read()
+            modified = pd.read_csv(files['modified'])
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(removed, "id,name,price\n3,cap,2\n")
+        self.assertEqual(modified.columns[0], 'id')
+        self.assertEqual(modified['id'].tolist(), [1])
+        self.assertEqual(result['removed']['id'].tolist(), [3])
+        self.assertEqual(result['added']['id'].tolist(), [4])
+        self.assertEqual(result['changes'].loc[1].tolist(), [False, True])
+
+    def test_compare_files_snapshot(self):
+        """Compare csv files through a baseline snapshot."""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshot = self.create_snapshot(
+                source_csv, os.path.join(temp_dir, "source.arrow"))
+            result = self.compare_files(snapshot, target_csv, chunksize=1)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(result['removed_rows'], 0)
+        self.assertEqual(result['added_rows'], 1)
+
+    def test_compare_files_snapshot_mixed(self):
+        """Refuse chunked diffs of parsed values against csv text."""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            snapshot = self.create_snapshot(
+                source_xl, os.path.join(temp_dir, "source.arrow"))
+            with self.assertRaises(ValueError):
+                self.compare_files(snapshot, target_csv, chunksize=1)
+            self.assertEqual(tablediff.hashed_from(snapshot), 'values')
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_compare_files_chunked(self):
+        """Compare csv files chunk by chunk."""
+        result = self.compare_files(source_csv, target_csv, chunksize=1)
+        os.remove(result['removed'])
+        os.remove(result['added'])
+        self.assertEqual(result['removed_rows'], 0)
+        self.assertEqual(result['added_rows'], 1)
+
+    def test_stream_diff_bounded(self):
+        """Split hash partitions larger than a chunk before diffing."""
+        temp_dir = tempfile.mkdtemp()
+        loaded = []
+
+        class Partitions(tablediff.HashPartitions):
+            def load(self, index):
+                pairs = super(Partitions, self).load(index)
+                loaded.append(len(pairs))
+                return pairs
+        try:
+            source = Partitions(temp_dir, 'source', 4, 50)
+            target = Partitions(temp_dir, 'target', 4, 50)
+            hashes = np.arange(2000, dtype=np.uint64) * np.uint64(7919)
+            source.add(hashes[:1900], np.arange(1900))
+            target.add(hashes[100:], np.arange(1900))
+            removed, added = [], []
+            tablediff._diff_partitions(source, target, removed, added)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(sorted(np.concatenate(removed)), list(range(100)))
+        self.assertEqual(sorted(np.concatenate(added)),
+                         list(range(1800, 1900)))
+        self.assertLessEqual(max(loaded), 50)
+
+    def test_excel_sink_long_names(self):
+        """Keep the tables of long sheet names on sheets of their own."""
+        temp_dir = tempfile.mkdtemp()
+        sheet = 'quarterly account balances sheet'
+        try:
+            sink = tablediff.make_sink('xlsx', temp_dir)
+            for table in ('changed', 'removed', 'added'):
+                sink.write(sheet + ' ' + table, pd.DataFrame({'a': [1]}))
+            result = sink.close()
+            sheets = pd.read_excel(result[sheet + ' added'], sheet_name=None)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(sorted(result), [sheet + ' added',
+                                          sheet + ' changed',
+                                          sheet + ' removed'])
+        self.assertEqual(len(sheets), 3)
+        self.assertTrue(all(len(frame) == 1 for frame in sheets.values()))
+
+    def test_compare_files_sink(self):
+        """Stream the difference to json lines files."""
+        temp_dir = tempfile.mkdtemp()
+        try:
+            result = self.compare_files(
+                source_csv, target_csv, sink='jsonl', out_dir=temp_dir)
+            with open(result['difference']) as handle:
+                lines = handle.readlines()
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertTrue(lines)
@@ -176,7 +176,8 @@ class TestClass(BrowserActions):
         sleep(5)
         self.click(PageObjects.links_all.get('dynamic_controls'))
         self.click(PageObjects.buttons_all.get('enable_btn'))
-        sleep(5)
+        self.wait_for_element(PageObjects.text_boxes.get('text_box'),
+                              'clickable')
         self.send_keys(PageObjects.text_boxes.get('text_box'))
         sleep(5)
         self.switch_to_default_content()
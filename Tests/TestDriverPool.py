@@ -0,0 +1,112 @@
+"""Tests of the browser profiles and the driver pool, run without a
+browser."""
+import os
+import unittest
+
+from urllib3.exceptions import MaxRetryError
+
+from imgqa import driverpool
+
+
+class TestBrowserProfile(unittest.TestCase):
+    """Select and merge browser profile settings."""
+
+    def setUp(self):
+        """Run every test without a profile in the environment."""
+        environ = os.environ.pop(driverpool.PROFILE_ENV, None)
+        if environ is not None:
+            self.addCleanup(os.environ.__setitem__, driverpool.PROFILE_ENV,
+                            environ)
+        self.addCleanup(os.environ.pop, driverpool.PROFILE_ENV, None)
+
+    def test_default(self):
+        """No name selects the default profile."""
+        self.assertEqual(driverpool.browser_profile(),
+                         driverpool.DEFAULT_PROFILE)
+
+    def test_environment(self):
+        """The environment variable selects the profile, a name wins."""
+        os.environ[driverpool.PROFILE_ENV] = 'headless'
+        self.assertTrue(driverpool.browser_profile()['headless'])
+        self.assertEqual(driverpool.browser_profile('fast')[
+            'page_load_strategy'], 'eager')
+
+    def test_merge(self):
+        """Settings missing from a profile are the default ones."""
+        settings = driverpool.browser_profile('headless')
+        self.assertEqual(sorted(settings), sorted(driverpool.DEFAULT_PROFILE))
+        self.assertEqual(settings['window_size'], driverpool.WINDOW_SIZE)
+        self.assertTrue(settings['images'])
+        self.assertEqual(settings['blocked_urls'], ())
+
+    def test_unknown(self):
+        """Unknown names and settings are refused."""
+        with self.assertRaises(ValueError):
+            driverpool.browser_profile('slowest')
+        os.environ[driverpool.PROFILE_ENV] = 'slowest'
+        with self.assertRaises(ValueError):
+            driverpool.browser_profile()
+        driverpool.PROFILES['broken'] = {'colour': 'blue'}
+        self.addCleanup(driverpool.PROFILES.pop, 'broken')
+        with self.assertRaises(ValueError):
+            driverpool.browser_profile('broken')
+
+
+class DeadSession(object):
+    """WebDriver stand-in whose browser stops responding when killed."""
+
+    def __init__(self):
+        """Start alive."""
+        self.dead = False
+        self.quit_calls = 0
+
+    def __check(self):
+        """Fail as selenium does once chromedriver is gone."""
+        if self.dead:
+            raise MaxRetryError(None, 'http://127.0.0.1:9515/session',
+                                'Connection refused')
+
+    @property
+    def current_url(self):
+        """Return the blank page."""
+        self.__check()
+        return driverpool.RESET_URL
+
+    @property
+    def window_handles(self):
+        """Return the single window."""
+        self.__check()
+        return ['main']
+
+    def quit(self):
+        """Count the quits, failing like a dead session."""
+        self.quit_calls += 1
+        self.__check()
+
+
+class TestDriverPool(unittest.TestCase):
+    """Recycle sessions that stop responding."""
+
+    def test_release_dead_session(self):
+        """A session failing to reset is quit and replaced, not leaked."""
+        pool = driverpool.DriverPool(factory=DeadSession)
+        driver = pool.lease()
+        driver.dead = True
+        pool.release(driver)
+        self.assertEqual(driver.quit_calls, 1)
+        self.assertEqual(pool.uses, {})
+        replacement = pool.lease(timeout=0)
+        self.assertIsNot(replacement, driver)
+
+    def test_lease_dead_session(self):
+        """An idle session found dead is replaced on lease."""
+        pool = driverpool.DriverPool(factory=DeadSession)
+        driver = pool.lease()
+        pool.idle.put(driver)
+        driver.dead = True
+        self.assertIsNot(pool.lease(timeout=0), driver)
+        self.assertEqual(len(pool.uses), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
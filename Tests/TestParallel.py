@@ -0,0 +1,145 @@
+"""Tests of the parallel runner, run without a browser."""
+import os
+import shutil
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from imgqa import parallel
+from imgqa.browseractions import BrowserActions
+
+SUITE_MODULE = '''
+from imgqa.browseractions import BrowserActions
+
+FIXTURES = {fixtures!r}
+
+
+def log(event):
+    with open(FIXTURES, 'a') as fixtures:
+        fixtures.write(event + '\\n')
+
+
+class PlainSuite(BrowserActions):
+
+    @classmethod
+    def setUpClass(cls):
+        log('setUpClass PlainSuite')
+
+    @classmethod
+    def tearDownClass(cls):
+        log('tearDownClass PlainSuite')
+
+    def test_pass(self):
+        self.assertEqual(1, 1)
+
+    def test_fail(self):
+        self.assertEqual(1, 2)
+
+    def test_skip(self):
+        self.skipTest('not today')
+
+
+class FastSuite(BrowserActions):
+
+    def test_one(self):
+        pass
+
+    def test_sub(self):
+        for number in (1, 2):
+            with self.subTest(number=number):
+                self.assertEqual(number, 1)
+
+    def test_two(self):
+        pass
+
+
+class BrokenSuite(BrowserActions):
+
+    @classmethod
+    def setUpClass(cls):
+        raise RuntimeError('no fixture')
+
+    def test_never_run(self):
+        pass
+'''
+
+
+class TestParallel(unittest.TestCase):
+    """Run a module of plain BrowserActions suites in worker processes."""
+
+    def setUp(self):
+        """Write the suite module to an importable directory."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.fixtures = os.path.join(self.temp_dir, 'fixtures.log')
+        with open(os.path.join(self.temp_dir, 'plainsuites.py'), 'w') as f:
+            f.write(textwrap.dedent(SUITE_MODULE).format(
+                fixtures=self.fixtures))
+        sys.path.insert(0, self.temp_dir)
+        self.addCleanup(sys.path.remove, self.temp_dir)
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.addCleanup(sys.modules.pop, 'plainsuites', None)
+
+    def test_run_parallel(self):
+        """Rows come back in test order, class fixtures running once."""
+        rows = parallel.run_parallel(['plainsuites'], workers=2,
+                                     screenshot_dir=self.temp_dir)
+        outcomes = [(row['test'], row['outcome']) for row in rows]
+        self.assertEqual(outcomes, [
+            ('plainsuites.BrokenSuite.test_never_run', 'error'),
+            ('plainsuites.FastSuite.test_one', 'passed'),
+            ('plainsuites.FastSuite.test_sub', 'failed'),
+            ('plainsuites.FastSuite.test_two', 'passed'),
+            ('plainsuites.PlainSuite.test_fail', 'failed'),
+            ('plainsuites.PlainSuite.test_pass', 'passed'),
+            ('plainsuites.PlainSuite.test_skip', 'skipped'),
+        ])
+        self.assertIn('no fixture', rows[0]['message'])
+        self.assertIn('2 != 1', rows[2]['message'])
+        self.assertIn('AssertionError', rows[4]['message'])
+        self.assertEqual(rows[6]['message'], 'not today')
+        # A class with fixtures runs in one worker, no browser was started.
+        self.assertEqual(len(set(row['worker'] for row in rows[4:])), 1)
+        self.assertTrue(all(row['screenshot'] is None for row in rows))
+        with open(self.fixtures) as fixtures:
+            self.assertEqual(fixtures.read().splitlines(),
+                             ['setUpClass PlainSuite',
+                              'tearDownClass PlainSuite'])
+
+    def test_jobs(self):
+        """Only the methods of classes with fixtures are run together."""
+        names = parallel.collect_test_names(['plainsuites'])
+        self.assertEqual([methods for methods, _ in parallel._jobs(
+            names, None)], [
+            ['plainsuites.BrokenSuite.test_never_run'],
+            ['plainsuites.FastSuite.test_one'],
+            ['plainsuites.FastSuite.test_sub'],
+            ['plainsuites.FastSuite.test_two'],
+            ['plainsuites.PlainSuite.test_fail',
+             'plainsuites.PlainSuite.test_pass',
+             'plainsuites.PlainSuite.test_skip']])
+
+    def test_collect_test_names(self):
+        """Modules and classes are expanded to test methods."""
+        self.assertEqual(
+            parallel.collect_test_names(['plainsuites.PlainSuite']),
+            ['plainsuites.PlainSuite.test_fail',
+             'plainsuites.PlainSuite.test_pass',
+             'plainsuites.PlainSuite.test_skip'])
+
+    def test_worker_profile_pools(self):
+        """Workers supply the pools of profiled suites too."""
+        for name in ('driver_pool', 'profile_pools', 'profile_pool_factory'):
+            self.addCleanup(setattr, BrowserActions, name,
+                            getattr(BrowserActions, name))
+        parallel._init_worker(True, 5)
+        pool = BrowserActions.profile_pool_factory('fast')
+        self.assertIsInstance(pool, parallel._WorkerPool)
+        self.assertEqual((pool.size, pool.max_uses), (1, 5))
+        # Headless as asked, whatever the profile.
+        self.assertEqual(pool.factory.args, (True, 'fast'))
+        self.assertEqual(BrowserActions.profile_pools, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,10 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from imgqa import browseractions
+from imgqa.locator import Locator
 from proboscis.asserts import assert_true
+import os
+import tempfile
 import time
 from selenium.webdriver.chrome.options import Options
 chrome_options = Options()
@@ -100,7 +103,7 @@ class TestClass(BrowserActions):
             PageObjects.buttons_all.get('openwindow'))
         self.click(
             PageObjects.buttons_all.get('openwindow'))
-        time.sleep(5)
+        self.wait_until(lambda driver: len(driver.window_handles) > 1)
         window_before = self.driver.window_handles[0]
         window_after = self.driver.window_handles[1]
         self.switch_to_window(window_after)
@@ -162,4 +165,122 @@ class TestClass(BrowserActions):
         time.sleep(5)
         self.capture_screenshot(
             "C:\\Users\\pramati\\Desktop\\Screenshots\\exampleScreenshot1.png")
-        self.switch_to_active_element()
\ No newline at end of file
+        self.switch_to_active_element()
+
+    def test_driver_pool(self):
+        """Released sessions are reset and leased again."""
+        self.open(PageObjects.base_url)
+        driver = self.driver
+        self.driver.add_cookie({"name": "imgqa", "value": "pool"})
+        self.open(PageObjects.two_url)
+        self.driver.add_cookie({"name": "imgqa", "value": "second"})
+        self.driver.execute_script("window.localStorage.setItem('imgqa', 'pool')")
+        self.release_driver(BrowserActions.driver_pool)
+        assert_true(self.driver is driver, "session is not reused")
+        self.open(PageObjects.base_url)
+        assert_true(self.driver.get_cookie("imgqa") is None,
+                    "session is not reset")
+        self.open(PageObjects.two_url)
+        assert_true(self.driver.get_cookie("imgqa") is None,
+                    "cookies of the second origin are not cleared")
+        assert_true(self.driver.execute_script(
+            "return window.localStorage.getItem('imgqa')") is None,
+            "storage of the second origin is not cleared")
+
+    def test_element_cache(self):
+        """Repeated lookups on one page are served from the cache."""
+        self.open(PageObjects.base_url)
+        self.get_text(PageObjects.labels_all.get("footer"))
+        self.get_text(PageObjects.labels_all.get("footer"))
+        assert_true(self.element_cache.hits == 1, "element is not cached")
+        self.reload_page()
+        self.get_text(PageObjects.labels_all.get("footer"))
+        assert_true(self.element_cache.misses == 2,
+                    "cache is not cleared on navigation")
+
+    def test_locator(self):
+        """Locators and their dictionaries find the same element."""
+        footer = Locator('By.CLASS_NAME', 'powered-by')
+        self.open(PageObjects.base_url)
+        assert_true(self.get_text(footer) == self.get_text(
+            PageObjects.labels_all.get("footer")), "locator is not found")
+        assert_true(self.element_cache.hits == 1,
+                    "locator and dictionary are not the same")
+
+    def test_bulk_reads(self):
+        """Bulk reads return what the single element keywords return."""
+        footer = PageObjects.labels_all.get("footer")
+        self.open(PageObjects.base_url)
+        assert_true(self.get_texts([footer]) == [self.get_text(footer)],
+                    "texts are not read")
+        snapshot = self.snapshot_elements(footer)[0]
+        assert_true(snapshot['attributes']['class'] == self.get_attributes(
+            footer, ['class'])[0]['class'], "attributes are not read")
+
+    def test_visual_match(self):
+        """An element capture matches the baseline made from it."""
+        footer = PageObjects.labels_all.get("footer")
+        baseline = os.path.join(tempfile.mkdtemp(), "footer.png")
+        self.open(PageObjects.base_url)
+        with open(baseline, "wb") as handle:
+            handle.write(self.get_element_screenshots([footer])[0])
+        assert_true(self.assert_visual_match(footer, baseline) >= 0.99,
+                    "capture does not match its baseline")
+        assert_true(os.listdir(os.path.dirname(baseline)) == ["footer.png"],
+                    "matching capture is written")
+
+    def test_page_readiness(self):
+        """Readiness is checked again only after a navigating action."""
+        footer = PageObjects.labels_all.get("footer")
+        scripts = []
+        execute_script = self.driver.execute_script
+
+        def counting_script(script, *args):
+            scripts.append(script)
+            return execute_script(script, *args)
+        self.driver.execute_script = counting_script
+        self.addCleanup(delattr, self.driver, "execute_script")
+        document = browseractions.readiness_script(("document",))
+        self.open(PageObjects.base_url)
+        self.get_text(footer)
+        self.get_text(footer)
+        assert_true(scripts.count(document) == 1,
+                    "readiness is checked without navigating")
+        self.open(PageObjects.base_url)
+        self.get_text(footer)
+        assert_true(scripts.count(document) == 2,
+                    "readiness is not checked after open")
+        self.page_readiness_wait(force=True)
+        assert_true(scripts.count(document) == 3,
+                    "readiness is not checked when forced")
+        signals = ["document.title.length > 0"]
+        self.page_readiness_wait(force=True, signals=signals)
+        assert_true(scripts[-1] == browseractions.readiness_script(signals),
+                    "custom signals are not checked")
+
+    def test_explicit_waits(self):
+        """Waits return what they waited for and time out with a message."""
+        footer = Locator('By.CLASS_NAME', 'powered-by')
+        missing = Locator('By.ID', 'imgqa-missing')
+        self.open(PageObjects.base_url)
+        text = self.get_text(footer)
+        assert_true(self.wait_for_text(footer, text).text == text,
+                    "element of the text is not returned")
+        assert_true(len(self.wait_for_count(footer, 1)) == 1,
+                    "elements of the count are not returned")
+        assert_true(len(self.wait_for_count(footer, 0, at_least=True)) >= 1,
+                    "more elements than at least are not accepted")
+        assert_true(self.wait_for_count(missing, 0) is True,
+                    "no elements are not waited for")
+        locator, element = self.wait_for_any([missing, footer], "visible")
+        assert_true(locator == footer and element.text == text,
+                    "first element found is not returned")
+        try:
+            self.wait_for_text(footer, "imgqa missing text", timeout=0.5)
+        except AssertionError as exc:
+            assert_true("imgqa missing text" in str(exc),
+                        "timeout does not name the condition")
+        else:
+            assert_true(False, "missing text is found")
+        assert_true(self.wait_timings[-1][1] >= 0.5,
+                    "timeout is not recorded")
@@ -1,11 +1,13 @@
 """UI utility functions of all selenium self.driver based actions."""
-from datetime import datetime
+import atexit
 
-from time import sleep
+import base64
 
-import os
+import functools
+
+from time import sleep, time
 
-from selenium import webdriver
+import os
 
 import logging
 
@@ -23,7 +25,11 @@ import unittest
 
 import platform
 
-from selenium.webdriver.common.by import By
+
+from imgqa import screenshots, waits
+from imgqa.comparison import compare_image
+from imgqa.driverpool import DriverPool, chrome
+from imgqa.locator import Locator, as_locator  # noqa
 
 if platform.system() == 'Darwin':
     from PIL import ImageGrab
@@ -32,18 +38,301 @@ WAIT_SLEEP_TIME = 0.1  # Seconds
 
 TIME_OUT = 10  # Seconds
 
+READY_POLL_MIN = 0.025  # Seconds, first readiness poll interval
+
+READY_POLL_MAX = 0.2  # Seconds, readiness poll interval after backoff
+
+NETWORK_IDLE_TIME = 500  # Milliseconds without a resource finishing
+
+VISUAL_MATCH_THRESHOLD = 0.99  # SSIM of captures matching their baseline
+
+# Javascript function bodies returning whether the page is ready.
+READINESS_SIGNALS = {
+    'document': "return document.readyState === 'complete';",
+    'network_idle': """
+        var last = 0, entries = performance.getEntriesByType('resource');
+        for (var i = 0; i < entries.length; i++) {
+            last = Math.max(last, entries[i].responseEnd);
+        }
+        return performance.now() - last >= %d;""" % NETWORK_IDLE_TIME,
+    'jquery': "return !window.jQuery || window.jQuery.active === 0;",
+}
+
+
+# Javascript function finding the elements of a (By strategy, value)
+# locator, shared by the bulk reads.
+LOCATE_FUNCTION = """
+function locate(by, value) {
+    var list = function (nodes) { return Array.prototype.slice.call(nodes); };
+    if (by === 'id') {
+        return list(document.querySelectorAll('[id="' + CSS.escape(value) +
+                                              '"]'));
+    }
+    if (by === 'name') { return list(document.getElementsByName(value)); }
+    if (by === 'class name') {
+        return list(document.getElementsByClassName(value));
+    }
+    if (by === 'tag name') {
+        return list(document.getElementsByTagName(value));
+    }
+    if (by === 'css selector') {
+        return list(document.querySelectorAll(value));
+    }
+    if (by === 'xpath') {
+        var found = [], result = document.evaluate(
+            value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE,
+            null);
+        for (var i = 0; i < result.snapshotLength; i++) {
+            found.push(result.snapshotItem(i));
+        }
+        return found;
+    }
+    return list(document.getElementsByTagName('a')).filter(function (a) {
+        var text = a.innerText.trim();
+        return by === 'link text' ? text === value : text.indexOf(value) >= 0;
+    });
+}
+function text(element) { return (element.innerText || '').trim(); }
+function attribute(element, name) {
+    var value = element[name];
+    if (value === undefined || value === null || typeof value === 'object' ||
+            typeof value === 'function') {
+        return element.getAttribute(name);
+    }
+    return value;
+}
+"""
+
+# Javascript returning the text of the first element of every locator.
+TEXTS_SCRIPT = LOCATE_FUNCTION + """
+return arguments[0].map(function (locator) {
+    var element = locate(locator[0], locator[1])[0];
+    return element ? text(element) : null;
+});
+"""
+
+# Javascript returning named attributes of the elements of a locator.
+ATTRIBUTES_SCRIPT = LOCATE_FUNCTION + """
+var names = arguments[2];
+return locate(arguments[0], arguments[1]).map(function (element) {
+    var values = {};
+    names.forEach(function (name) {
+        values[name] = attribute(element, name);
+    });
+    return values;
+});
+"""
+
+# Javascript returning the tag, text, attributes, geometry and visibility
+# of the elements of a locator.
+SNAPSHOT_SCRIPT = LOCATE_FUNCTION + """
+return locate(arguments[0], arguments[1]).map(function (element) {
+    var attributes = {}, rect = element.getBoundingClientRect();
+    for (var i = 0; i < element.attributes.length; i++) {
+        attributes[element.attributes[i].name] = element.attributes[i].value;
+    }
+    return {
+        tag: element.tagName.toLowerCase(),
+        text: text(element),
+        value: element.value === undefined ? null : element.value,
+        attributes: attributes,
+        rect: {x: rect.left + window.pageXOffset,
+               y: rect.top + window.pageYOffset,
+               width: rect.width, height: rect.height},
+        displayed: element.getClientRects().length > 0 &&
+            window.getComputedStyle(element).visibility !== 'hidden'
+    };
+});
+"""
+
+
+# Javascript returning the page rect of the first element of every locator,
+# the scroll offset, viewport size and page size.
+LAYOUT_SCRIPT = LOCATE_FUNCTION + """
+var root = document.documentElement;
+return {
+    rects: arguments[0].map(function (locator) {
+        var element = locate(locator[0], locator[1])[0];
+        if (!element) { return null; }
+        var rect = element.getBoundingClientRect();
+        return [rect.left + window.pageXOffset, rect.top + window.pageYOffset,
+                rect.width, rect.height];
+    }),
+    scroll: [window.pageXOffset, window.pageYOffset],
+    viewport: [window.innerWidth, window.innerHeight],
+    page: [Math.max(root.scrollWidth, document.body.scrollWidth),
+           Math.max(root.scrollHeight, document.body.scrollHeight)]
+};
+"""
+
+# Javascript scrolling to a page offset and returning the offset reached.
+SCROLL_SCRIPT = """
+window.scrollTo(arguments[0], arguments[1]);
+return [window.pageXOffset, window.pageYOffset];
+"""
+
+
+def readiness_script(signals):
+    """Return the script checking readiness signals in one round trip.
+
+    :param signals: names of READINESS_SIGNALS or javascript expressions
+        true once the page is ready(e.g. 'window.appLoaded === true').
+    :rtype: str
+    """
+    checks = ','.join(
+        'function(){%s}' % READINESS_SIGNALS.get(
+            signal, 'return !!(%s);' % signal)
+        for signal in signals)
+    return ('var checks = [%s];'
+            'for (var i = 0; i < checks.length; i++) {'
+            'if (!checks[i]()) { return false; } }'
+            'return true;' % checks)
+
+
+def navigates(func):
+    """Mark the page for a readiness check after an action.
+
+    Applied to the actions that may load a new document, so the others
+    skip page_readiness_wait round trips, and the elements cached for the
+    previous document are dropped.
+    """
+    @functools.wraps(func)
+    def action(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.page_changed = True
+            self.element_cache.clear()
+    return action
+
+
+class ElementCache(object):
+    """Elements found on the current page, keyed by (by, value).
+
+    hits and misses count the lookups served from the cache and sent to
+    the driver since the cache was created.
+    """
+
+    def __init__(self):
+        """Start with no element."""
+        self.elements = {}
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, driver, by, value):
+        """Return the cached element of a locator, finding it on a miss.
+
+        :param driver: WebDriver session.
+        :param by: locator strategy(By.ID...).
+        :param value: locator value.
+        :return: web element.
+        """
+        key = (by, value)
+        element = self.elements.get(key)
+        if element is None:
+            self.misses += 1
+            element = self.elements[key] = driver.find_element(by, value)
+        else:
+            self.hits += 1
+        return element
+
+    def evict(self, by, value):
+        """Forget the element of a locator."""
+        self.elements.pop((by, value), None)
+
+    def clear(self):
+        """Forget every element, as on navigation."""
+        self.elements.clear()
+
 
 class BrowserActions(unittest.TestCase):
     """PageActions Class is the gateway for using Framework.
 
     It inherits Python's unittest.TestCase class, and runs with Pytest.
+    Browser sessions are leased from driver_pool on first use of
+    self.driver and released once the test finishes, so tests reuse
+    browsers instead of starting one each. Assign a
+    DriverPool(size, max_uses, prewarm=True) to BrowserActions.driver_pool
+    to configure it. Suites setting browser_profile, e.g. 'fast', lease
+    sessions of that profile from a pool of their own instead.
     """
 
+    driver_pool = None  # DriverPool shared by all tests, made on first use
+
+    # driverpool.PROFILES name of the sessions of a suite, None for
+    # driver_pool, whose sessions follow $IMGQA_BROWSER_PROFILE.
+    browser_profile = None
+
+    profile_pools = {}  # DriverPool of every browser_profile
+
+    # Callable taking a browser_profile and returning the DriverPool of its
+    # suites, None for a DriverPool of chrome sessions of the profile.
+    profile_pool_factory = None
+
+    # ScreenshotWriter of background captures, made on first use.
+    screenshot_writer = None
+
+    # Signals page_readiness_wait waits for, see readiness_script.
+    readiness_signals = ('document',)
+
+    use_element_cache = True  # Reuse found elements until navigation
+
+    wait_timeout = TIME_OUT  # Seconds of the explicit waits
+
+    wait_poll = WAIT_SLEEP_TIME  # Seconds between explicit wait checks
+
     def __init__(self, *args, **kwargs):
         """Init Method for webdriver declarations."""
         super(BrowserActions, self).__init__(*args, **kwargs)
         self.by_value = None
-        self.driver = webdriver.Chrome()
+        self._driver = None
+        self.page_changed = True
+        self.element_cache = ElementCache()
+        self.wait_timings = []  # (condition, seconds) of explicit waits
+
+    @property
+    def driver(self):
+        """WebDriver session leased for the current test."""
+        if self._driver is None:
+            pool = self.__session_pool()
+            self._driver = pool.lease()
+            self.addCleanup(self.release_driver, pool)
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver):
+        """Use a WebDriver session of your own."""
+        self._driver = driver
+        self.page_changed = True
+        self.element_cache.clear()
+
+    def __session_pool(self):
+        """Return the pool of the browser_profile of the suite."""
+        if self.browser_profile is None:
+            if BrowserActions.driver_pool is None:
+                BrowserActions.driver_pool = DriverPool()
+                atexit.register(BrowserActions.driver_pool.close)
+            return BrowserActions.driver_pool
+        pool = BrowserActions.profile_pools.get(self.browser_profile)
+        if pool is None:
+            factory = BrowserActions.profile_pool_factory
+            if factory is None:
+                pool = DriverPool(factory=functools.partial(
+                    chrome, profile=self.browser_profile))
+            else:
+                pool = factory(self.browser_profile)
+            BrowserActions.profile_pools[self.browser_profile] = pool
+            atexit.register(pool.close)
+        return pool
+
+    def release_driver(self, pool):
+        """Return the leased session to the pool, reset for the next test.
+
+        :param pool: DriverPool the session was leased from.
+        """
+        driver, self._driver = self._driver, None
+        if driver is not None:
+            pool.release(driver)
 
     # TBD: Decorator implementation
     # def page_readiness_wait(self, func):
@@ -66,22 +355,59 @@ class BrowserActions(unittest.TestCase):
     #         func(*args, **kargs)
     #     return page_ready
 
-    def page_readiness_wait(self):
-        """Web Page Expected to be in ready state."""
-        start = datetime.now()
-        while (datetime.now() - start).total_seconds() < TIME_OUT:
-            pagestate = self.driver.execute_script(
-                '''return document.readyState''')
-            pagestate = pagestate.lower()
-            if pagestate == 'complete':
-                current_state = "Current page is in expected state {}"
-                logging.info(current_state.format(pagestate))
-                break
-            sleep(0.2)
-            loop_time_now = datetime.now() - start.total_seconds()
-            if loop_time_now > TIME_OUT and pagestate != 'complete':
+    def page_readiness_wait(self, force=False, signals=None):
+        """Web Page Expected to be in ready state.
+
+        Readiness is only checked after an action that may have loaded a
+        new document(open, click, go_back...), polling all signals in one
+        script with a backoff from READY_POLL_MIN to READY_POLL_MAX.
+        :param force: check even if no action navigated since last check.
+        :param signals: signals to wait for, defaults to
+            self.readiness_signals('document', 'network_idle', 'jquery'
+            or javascript expressions).
+        """
+        if not (force or self.page_changed):
+            return
+        signals = signals or self.readiness_signals
+        script = readiness_script(signals)
+        start = time()
+        interval = READY_POLL_MIN
+        while not self.driver.execute_script(script):
+            if time() - start > TIME_OUT:
                 raise AssertionError(
-                    "Opened browser is in state of %s" % pagestate)
+                    "Page not ready for {} within {} seconds".format(
+                        ', '.join(signals), TIME_OUT))
+            sleep(interval)
+            interval = min(interval * 2, READY_POLL_MAX)
+        logging.info("Current page is ready for %s after %.3f seconds",
+                     ', '.join(signals), time() - start)
+        self.page_changed = False
+
+    def find_element(self, locator):
+        """Return the element of a locator, from the element cache.
+
+        :param locator: Locator or locator dictionary.
+        :return: web element.
+        """
+        locator = as_locator(locator)
+        if not self.use_element_cache:
+            return self.driver.find_element(locator.by, locator.value)
+        return self.element_cache.find(self.driver, locator.by, locator.value)
+
+    def on_element(self, locator, action):
+        """Run an action on the element of a locator.
+
+        A cached element gone stale is found again and the action retried.
+        :param locator: Locator or locator dictionary.
+        :param action: callable taking the web element.
+        :return: result of action.
+        """
+        locator = as_locator(locator)
+        try:
+            return action(self.find_element(locator))
+        except selenium_exceptions.StaleElementReferenceException:
+            self.element_cache.evict(locator.by, locator.value)
+            return action(self.find_element(locator))
 
     # TBD: to be turned into decorator
 
@@ -99,26 +425,18 @@ class BrowserActions(unittest.TestCase):
     #     return consruct_locator
 
     def locator_check(self, locator_dict):
-        """Local Method to classify the type of locator."""
-        text_retrived = locator_dict['by'].upper()
-        if 'ID' in text_retrived:
-            by = By.ID
-        if 'CLASS_NAME' in text_retrived:
-            by = By.CLASS_NAME
-        if 'CSS_SELECTOR' in text_retrived:
-            by = By.CSS_SELECTOR
-        if 'NAME' in text_retrived:
-            by = By.NAME
-        if 'LINK_TEXT' in text_retrived:
-            by = By.LINK_TEXT
-        if 'PARTIAL_LINK_TEXT' in text_retrived:
-            by = By.PARTIAL_LINK_TEXT
-        if 'XPATH' in text_retrived:
-            by = By.XPATH
-        if 'TAG_NAME' in text_retrived:
-            by = By.TAG_NAME
-        self.by_value = by
+        """Local Method to classify the type of locator.
 
+        :param locator_dict: Locator or locator dictionary.
+        :return: Locator with its By strategy resolved, whose strategy is
+            also kept in self.by_value.
+        :rtype: Locator
+        """
+        locator = as_locator(locator_dict)
+        self.by_value = locator.by
+        return locator
+
+    @navigates
     def open(self, url):
         """Open the passed 'url'."""
         if url is not None:
@@ -134,6 +452,7 @@ class BrowserActions(unittest.TestCase):
         else:
             raise AssertionError("Invalid/ URL cannot be null")
 
+    @navigates
     def reload_page(self):
         """Method to refresh the page by selenium or java script."""
         try:
@@ -173,66 +492,56 @@ class BrowserActions(unittest.TestCase):
     def get_attribute(self, locator, attribute_name=None):
         """Fetch attribute from provided locator.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         :param attribute_name: attribute name to get it's vale
         """
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if not attribute_name and isinstance(locator, dict):
-            return self.driver.find_element(
-                self.by_value,
-                value=locator['locatorvalue']).get_attribute(attribute_name)
+        if attribute_name:
+            return self.on_element(
+                locator,
+                lambda element: element.get_attribute(attribute_name))
         else:
             raise AssertionError(
                 "Invalid locator or Attribute is'{}'".format(attribute_name))
 
+    @navigates
     def click(self, locator):
         """Click an element.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        # self.locator_check(locator)
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            self.driver.find_element(
-                self.by_value,
-                value=locator['locatorvalue']).click()
-
-        else:
-            raise AssertionError("Locator type should be dictionary.")
+        self.on_element(locator, lambda element: element.click())
 
+    @navigates
     def send_keys(self, locator):
         """Send text but does not clear the existing text.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
+            The text sent is the 'value' of dictionaries and the text of
+            Locators.
         """
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            self.locator_check(locator)
-            self.driver.find_element(
-                self.by_value,
-                locator['locatorvalue']).send_keys(locator['value'])
-        else:
-            raise AssertionError("Locator type should be dictionary.")
+        self.on_element(locator,
+                        lambda element: element.send_keys(locator.text))
 
     def get_text(self, locator):
         """Get text from provided Locator.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            return self.driver.find_element(self.by_value,
-                                            value=locator['locatorvalue']).text
-        else:
-            raise AssertionError("Locator type should be dictionary.")
+        return self.on_element(locator, lambda element: element.text)
 
+    @navigates
     def go_back(self):
         """Simulate back button on browser using selenium or js."""
         try:
@@ -240,6 +549,7 @@ class BrowserActions(unittest.TestCase):
         except BaseException:
             self.driver.execute_script("window.history.go(-1)")
 
+    @navigates
     def go_forward(self):
         """Simulate forward button on browser using  selenium or js."""
         try:
@@ -285,22 +595,20 @@ class BrowserActions(unittest.TestCase):
     def clear_text(self, locator):
         """Clear the text if it's a text entry element.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            return self.driver.find_element(
-                self.by_value,
-                value=locator['locatorvalue']).clear()
-        else:
-            raise AssertionError("Locator type should be dictionary")
+        return self.on_element(locator, lambda element: element.clear())
 
-    def capture_screenshot(self, filepath):
+    def capture_screenshot(self, filepath, background=False):
         """Save screenshot to the directory(existing or new one).
 
         :param filepath: file name with directory path(C:/images/image.png).
+        :param background: (optional) capture in memory and leave the file
+            write to the screenshot_writer thread, see flush_screenshots.
+        :return: file path.
         """
         self.page_readiness_wait()
 
@@ -309,6 +617,9 @@ class BrowserActions(unittest.TestCase):
                          ' because no browser is open.')
             return
         path = filepath.replace('/', os.sep)
+        if background:
+            return self.__screenshot_writer().write(
+                path, self.driver.get_screenshot_as_png())
 
         if not os.path.exists(path.split(os.sep)[0]):
             os.makedirs(path.split(os.sep)[0])
@@ -318,6 +629,175 @@ class BrowserActions(unittest.TestCase):
             raise RuntimeError("Failed to save screenshot '{}'.".format(path))
         return path
 
+    def get_screenshot(self, as_array=False):
+        """Capture the screen in memory, without writing a file.
+
+        The result is accepted by Compare.compare_images as is.
+        :param as_array: (optional) return the decoded BGR image instead of
+            the PNG bytes.
+        :return: PNG bytes or numpy array.
+        """
+        self.page_readiness_wait()
+        data = self.driver.get_screenshot_as_png()
+        return screenshots.decode(data) if as_array else data
+
+    def flush_screenshots(self):
+        """Wait for the screenshots captured in background to be written.
+
+        Raises IOError if any of them failed to be written.
+        """
+        if BrowserActions.screenshot_writer is not None:
+            BrowserActions.screenshot_writer.flush()
+
+    def get_full_page_screenshot(self, as_array=False, method=None):
+        """Capture the whole page, beyond the viewport, in memory.
+
+        :param as_array: (optional) return the decoded BGR image instead of
+            the PNG bytes.
+        :param method: (optional) 'cdp' for the DevTools full size capture
+            of Chrome, 'stitch' to scroll the page and stitch viewport
+            captures(fixed headers then repeat), defaults to 'cdp' falling
+            back to 'stitch'.
+        :return: PNG bytes or numpy array.
+        """
+        self.page_readiness_wait()
+        image = self.__full_page_capture(method)[0]
+        return image if as_array else screenshots.encode_png(image)
+
+    def get_element_screenshots(self, locators, as_array=False):
+        """Capture several elements, cropped from one capture.
+
+        The viewport is captured when it shows every element, else the
+        full page.
+        :param locators: Locators or locator dictionaries.
+        :param as_array: (optional) return decoded BGR images instead of
+            PNG bytes.
+        :return: capture of the first element of every locator.
+        :rtype: list
+        """
+        locators = [as_locator(locator) for locator in locators]
+        self.page_readiness_wait()
+        layout = self.driver.execute_script(
+            LAYOUT_SCRIPT,
+            [[locator.by, locator.value] for locator in locators])
+        missing = [str(locator) for locator, rect
+                   in zip(locators, layout['rects']) if rect is None]
+        if missing:
+            raise AssertionError(
+                "Elements {} not found".format(', '.join(missing)))
+        left, top = layout['scroll']
+        width, height = layout['viewport']
+        rects = [(x - left, y - top, w, h) for x, y, w, h in layout['rects']]
+        if all(x >= 0 and y >= 0 and x + w <= width and y + h <= height
+               for x, y, w, h in rects):
+            image = screenshots.decode(self.driver.get_screenshot_as_png())
+            scale = image.shape[1] / float(width)
+        else:
+            image, scale = self.__full_page_capture()
+            rects = layout['rects']
+        crops = [screenshots.crop(image, rect, scale) for rect in rects]
+        return crops if as_array else [
+            screenshots.encode_png(region) for region in crops]
+
+    def assert_visual_match(self, locator, baseline,
+                            threshold=VISUAL_MATCH_THRESHOLD, **options):
+        """Compare an element capture with its baseline image in memory.
+
+        Nothing is written when the capture matches. Otherwise it is saved
+        as <baseline name>_actual.png, or as the baseline when there is
+        none yet, in background(see flush_screenshots), and the assertion
+        fails.
+        :param locator: Locator or locator dictionary, None for the full
+            page.
+        :param baseline: baseline image path.
+        :param threshold: (optional) lowest SSIM score matching.
+        :param options: comparison options of Compare.compare_images.
+        :return: SSIM score.
+        :rtype: float
+        """
+        if locator is None:
+            capture = self.get_full_page_screenshot(as_array=True)
+        else:
+            locator = as_locator(locator)
+            capture = self.get_element_screenshots(
+                [locator], as_array=True)[0]
+        if not os.path.exists(baseline):
+            self.__screenshot_writer().write(baseline, capture)
+            raise AssertionError(
+                "No baseline '{}', the capture is saved as baseline".format(
+                    baseline))
+        score = compare_image(baseline, capture, **options)['score']
+        if score < threshold:
+            actual = os.path.splitext(baseline)[0] + '_actual.png'
+            self.__screenshot_writer().write(actual, capture)
+            raise AssertionError(
+                "Capture of {} differs from '{}', score {:.4f} below {}, "
+                "saved as '{}'".format(
+                    locator or 'page', baseline, score, threshold, actual))
+        return score
+
+    def __full_page_capture(self, method=None):
+        """Return the decoded full page image and its pixels per CSS px."""
+        if method not in (None, 'cdp', 'stitch'):
+            raise AssertionError(
+                "Unknown full page capture method '{}'".format(method))
+        captured = None if method == 'stitch' else self.__cdp_capture()
+        if captured is None:
+            if method == 'cdp':
+                raise AssertionError(
+                    "DevTools capture is not supported by this driver")
+            return self.__stitched_capture()
+        data, width = captured
+        image = screenshots.decode(data)
+        return image, image.shape[1] / float(width)
+
+    def __cdp_capture(self):
+        """Return the DevTools full size PNG and page width, or None."""
+        execute = getattr(self.driver, 'execute_cdp_cmd', None)
+        if execute is None:
+            return None
+        try:
+            metrics = execute('Page.getLayoutMetrics', {})
+            size = metrics.get('cssContentSize') or metrics['contentSize']
+            shot = execute('Page.captureScreenshot', {
+                'format': 'png', 'captureBeyondViewport': True,
+                'clip': {'x': 0, 'y': 0, 'width': size['width'],
+                         'height': size['height'], 'scale': 1}})
+        except selenium_exceptions.WebDriverException as exc:
+            logging.info("DevTools capture failed, stitching: %s", exc)
+            return None
+        return base64.b64decode(shot['data']), size['width']
+
+    def __stitched_capture(self):
+        """Scroll the page and stitch its viewport captures."""
+        layout = self.driver.execute_script(LAYOUT_SCRIPT, [])
+        width, height = layout['viewport']
+        page_height = layout['page'][1]
+        tiles = []
+        scale = None
+        offset = 0
+        try:
+            while True:
+                top = self.driver.execute_script(SCROLL_SCRIPT, 0, offset)[1]
+                tile = screenshots.decode(self.driver.get_screenshot_as_png())
+                scale = scale or tile.shape[1] / float(width)
+                tiles.append((int(round(top * scale)), tile))
+                if top + height >= page_height or top < offset:
+                    break
+                offset = top + height
+        finally:
+            self.driver.execute_script(SCROLL_SCRIPT, *layout['scroll'])
+        return screenshots.stitch(
+            tiles, int(round(page_height * scale))), scale
+
+    def __screenshot_writer(self):
+        """Return the shared ScreenshotWriter, made on first use."""
+        if BrowserActions.screenshot_writer is None:
+            BrowserActions.screenshot_writer = screenshots.ScreenshotWriter()
+            # Write the queued screenshots before the interpreter exits.
+            atexit.register(BrowserActions.screenshot_writer.close)
+        return BrowserActions.screenshot_writer
+
     def switch_to_active_element(self):
         """Return the element with focus, or BODY if nothing has focus."""
         self.page_readiness_wait()
@@ -326,6 +806,7 @@ class BrowserActions(unittest.TestCase):
         except BaseException:
             return self.driver.execute_script('''document.activeElement''')
 
+    @navigates
     def switch_to_window(self, window):
         """Switch focus to the specified window using selenium/javascript.
 
@@ -337,6 +818,7 @@ class BrowserActions(unittest.TestCase):
             AssertionError(
                 "Targeted window {} to be switched doesn't exist".window)
 
+    @navigates
     def switch_to_frame(self, framename):
         """Switch focus to the specified frame using selenium/javascript.
 
@@ -349,6 +831,7 @@ class BrowserActions(unittest.TestCase):
             AssertionError(
                 "Targeted frame {} to be switched doesn't exist".framename)
 
+    @navigates
     def switch_to_default_content(self):
         """Switch focus to the default frame."""
         self.page_readiness_wait()
@@ -368,57 +851,131 @@ class BrowserActions(unittest.TestCase):
     def hover_on_element(self, locator):
         """Hover on a particular element.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            try:
-                ActionChains(self.driver).move_to_element(
-                    self.driver.find_element(
-                        self.by_value,
-                        value=locator['locatorvalue'])).perform()
-            except selenium_exceptions.NoSuchElementException:
-                AssertionError(
-                    "Element{} not found".format(locator['by']) +
-                    '=' + locator['value'])
-        else:
-            raise AssertionError("Locator type should be dictionary")
+        try:
+            self.on_element(
+                locator,
+                lambda element: ActionChains(
+                    self.driver).move_to_element(element).perform())
+        except selenium_exceptions.NoSuchElementException:
+            raise AssertionError("Element {} not found".format(locator))
 
     def hover_on_click(self, locator):
         """Hover & click a particular element.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        self.locator_check(locator)
+        locator = as_locator(locator)
         self.page_readiness_wait()
         try:
             self.hover_on_element(locator)
             self.click(locator)
         except selenium_exceptions.NoSuchElementException:
-            AssertionError(
-                "Element {} not found".format(
-                    locator['by']) + '=' + locator['value'])
-
-    def wait_for_element(self, locator):
+            raise AssertionError("Element {} not found".format(locator))
+
+    def wait_until(self, condition, timeout=None, poll=None):
+        """Wait for a condition, recording how long it took.
+
+        The seconds waited are logged and appended with the condition
+        description to self.wait_timings, timeouts included.
+        :param condition: imgqa.waits condition or callable taking the
+            WebDriver, returning a true value once met.
+        :param timeout: (optional) seconds, defaults to wait_timeout.
+        :param poll: (optional) seconds between checks, defaults to
+            wait_poll.
+        :return: result of the condition.
+        """
+        timeout = self.wait_timeout if timeout is None else timeout
+        poll = self.wait_poll if poll is None else poll
+        start = time()
+        try:
+            result = Wait(self.driver, timeout, poll_frequency=poll,
+                          ignored_exceptions=waits.IGNORED_EXCEPTIONS
+                          ).until(condition)
+        except selenium_exceptions.TimeoutException:
+            elapsed = time() - start
+            self.wait_timings.append((str(condition), elapsed))
+            raise AssertionError(
+                "Timed out after {:.2f} seconds waiting for {}".format(
+                    elapsed, condition))
+        elapsed = time() - start
+        self.wait_timings.append((str(condition), elapsed))
+        logging.info("Waited %.3f seconds for %s", elapsed, condition)
+        return result
+
+    def wait_for_element(self, locator, state='present', timeout=None,
+                         poll=None):
         """Wait for an element to exist in UI.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
+        :param state: (optional) 'present', 'visible' or 'clickable'.
+        :param timeout: (optional) seconds, defaults to wait_timeout.
+        :param poll: (optional) seconds between checks, defaults to
+            wait_poll.
+        :return: web element.
         """
-        self.locator_check(locator)
+        condition = waits.element(locator, state)
         self.page_readiness_wait()
-        try:
-            if self.driver.find_element(
-                    self.by_value,
-                    value=locator['locatorvalue']):
-                return True
-        except selenium_exceptions.NoSuchElementException:
-            AssertionError("Failed to wait for element {}".format(
-                locator['by'] + '=' + locator['value']))
+        return self.wait_until(condition, timeout, poll)
+
+    def wait_for_text(self, locator, text, timeout=None, poll=None):
+        """Wait for the text of an element to contain a text.
+
+        :param locator: Locator or dictionary of identifier type
+            and value ({'by':'id', 'value':'start-of-content.'}).
+        :param text: expected text.
+        :param timeout: (optional) seconds, defaults to wait_timeout.
+        :param poll: (optional) seconds between checks, defaults to
+            wait_poll.
+        :return: web element.
+        """
+        condition = waits.text(locator, text)
+        self.page_readiness_wait()
+        return self.wait_until(condition, timeout, poll)
+
+    def wait_for_count(self, locator, number, at_least=False, timeout=None,
+                       poll=None):
+        """Wait for a locator to match a number of elements.
+
+        :param locator: Locator or dictionary of identifier type
+            and value ({'by':'id', 'value':'start-of-content.'}).
+        :param number: number of elements.
+        :param at_least: (optional) also accept more elements.
+        :param timeout: (optional) seconds, defaults to wait_timeout.
+        :param poll: (optional) seconds between checks, defaults to
+            wait_poll.
+        :return: web elements, True when waiting for none.
+        """
+        condition = waits.count(locator, number, at_least)
+        self.page_readiness_wait()
+        return self.wait_until(condition, timeout, poll)
+
+    def wait_for_any(self, locators, state='present', timeout=None,
+                     poll=None):
+        """Wait for the first of several elements to reach a state.
+
+        :param locators: Locators or locator dictionaries, checked in order.
+        :param state: (optional) 'present', 'visible' or 'clickable'.
+        :param timeout: (optional) seconds, defaults to wait_timeout.
+        :param poll: (optional) seconds between checks, defaults to
+            wait_poll.
+        :return: (locator, web element) of the first element found.
+        :rtype: tuple
+        """
+        locators = list(locators)
+        condition = waits.first_of(
+            waits.element(locator, state) for locator in locators)
+        self.page_readiness_wait()
+        index, found = self.wait_until(condition, timeout, poll)
+        return locators[index], found
 
+    @navigates
     def wait_and_accept_alert(self):
         """Wait and accept alert present on the page."""
         try:
@@ -429,6 +986,7 @@ class BrowserActions(unittest.TestCase):
             logging.error(
                 "Could Not Find Alert Within The Permissible Time Limit")
 
+    @navigates
     def wait_and_reject_alert(self):
         """Wait for alert and rejects."""
         try:
@@ -439,67 +997,108 @@ class BrowserActions(unittest.TestCase):
             logging.error(
                 "Could Not Find Alert Within The Permissible Time Limit")
 
+    @navigates
     def select_option_by_index(self, locator, index):
         """Select the option by index.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         :param index: integer value for index.
         """
-        self.by_value = locator['by']
-        if isinstance(locator, dict) and isinstance(index, int):
-            self.locator_check(locator)
+        locator = as_locator(locator, 'value')
+        self.by_value = locator.by
+        if isinstance(index, int):
             try:
-                Select(self.driver.find_element(
-                    self.by_value,
-                    value=locator['value'])).select_by_index(index)
+                self.on_element(
+                    locator,
+                    lambda element: Select(element).select_by_index(index))
             except selenium_exceptions.NoSuchElementException:
                 logging.error("Exception : Element '{}' Not Found".format(
-                    locator['by'] + '=' + locator['value']))
+                    locator))
         else:
-            AssertionError(
+            raise AssertionError(
                 "Invalid locator '{}' or index '{}'".format(locator, index))
 
+    @navigates
     def select_option_by_value(self, locator, value):
         """Select the option by using value.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         :param value: string value to select option.
         """
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict) and isinstance(value, int):
-            try:
-                Select(self.driver.find_element(
-                    self.by_value,
-                    value=locator['locatorvalue'])).select_by_value(value)
-
-            except selenium_exceptions.NoSuchElementException:
-                logging.error("Exception : Element '{}' Not Found".format(
-                    locator['by'] + '=' + locator['value']))
-        else:
-            AssertionError(
-                "Invalid locator '{}' or value '{}'".format(locator, value))
+        try:
+            self.on_element(
+                locator,
+                lambda element: Select(element).select_by_value(value))
+        except selenium_exceptions.NoSuchElementException:
+            logging.error("Exception : Element '{}' or option '{}' "
+                          "Not Found".format(locator, value))
 
+    @navigates
     def select_option_by_text(self, locator, text):
         """Select the value by using text.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         :param text: string value to select option.
         """
+        locator = as_locator(locator, 'value')
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            self.locator_check(locator)
-            try:
-                Select(self.driver.find_element(
-                    self.by_value,
-                    value=locator['value'])).select_by_visible_text(text)
-            except selenium_exceptions.NoSuchElementException:
-                logging.error("Exception : Element '{}' Not Found".format(
-                    locator['by'] + '=' + locator['value']))
-        else:
-            AssertionError("Invalid locator type")
+        try:
+            self.on_element(
+                locator,
+                lambda element: Select(element).select_by_visible_text(text))
+        except selenium_exceptions.NoSuchElementException:
+            logging.error("Exception : Element '{}' Not Found".format(
+                locator))
+
+    def get_texts(self, locators):
+        """Get the text of many elements in one round trip.
+
+        :param locators: Locators or locator dictionaries.
+        :return: text of the first element of every locator, None for
+            locators matching no element.
+        :rtype: list
+        """
+        locators = [as_locator(locator) for locator in locators]
+        self.page_readiness_wait()
+        return self.driver.execute_script(
+            TEXTS_SCRIPT,
+            [[locator.by, locator.value] for locator in locators])
+
+    def get_attributes(self, locator, names):
+        """Get attributes of every element of a locator in one round trip.
+
+        Like get_attribute, the property of a name is returned when it is
+        a string, number or boolean, else its attribute.
+        :param locator: Locator or dictionary of identifier type
+            and value ({'by':'id', 'value':'start-of-content.'}).
+        :param names: attribute names.
+        :return: name to value dictionary of every element.
+        :rtype: list
+        """
+        locator = as_locator(locator)
+        self.page_readiness_wait()
+        return self.driver.execute_script(
+            ATTRIBUTES_SCRIPT, locator.by, locator.value, list(names))
+
+    def snapshot_elements(self, locator):
+        """Read the elements of a locator in one round trip.
+
+        :param locator: Locator or dictionary of identifier type
+            and value ({'by':'id', 'value':'start-of-content.'}).
+        :return: dictionary of tag, text, value, attributes(name to value),
+            rect(page x, y, width and height) and displayed of every
+            element.
+        :rtype: list
+        """
+        locator = as_locator(locator)
+        self.page_readiness_wait()
+        return self.driver.execute_script(
+            SNAPSHOT_SCRIPT, locator.by, locator.value)
 
     def scroll_to_footer(self):
         """Scroll till end of the page."""
@@ -513,40 +1112,30 @@ class BrowserActions(unittest.TestCase):
     def find_elements(self, locator):
         """Return elements matched with locator.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
-        self.locator_check(locator)
+        locator = as_locator(locator, 'value')
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            return self.driver.find_elements(
-                    self.by_value,
-                    value=locator['value'])
-        else:
-            AssertionError("Invalid locator type")
+        return self.driver.find_elements(locator.by, locator.value)
 
     def scroll_to_element(self, locator):
         """Scroll to a particular element on the page.
 
-        :param locator: dictionary of identifier type
+        :param locator: Locator or dictionary of identifier type
             and value ({'by':'id', 'value':'start-of-content.'}).
         """
+        locator = as_locator(locator)
         self.page_readiness_wait()
-        if isinstance(locator, dict):
-            try:
-                self.locator_check(locator)
-                element = self.driver.find_element(
-                    self.by_value,
-                    value=locator['locatorvalue'])
-                actions = ActionChains(self.driver)
-                actions.move_to_element(element).perform()
-            except selenium_exceptions.NoSuchElementException:
-                logging.error('Exception : Not Able To Scroll to Element')
-            except BaseException:
-                self.driver.execute_script(
-                    "arguments[0].scrollIntoView(true)",
-                    self.driver.find_element(
-                        self.by_value,
-                        value=locator['locatorvalue']))
-        else:
-            AssertionError("Invalid locator type")
+        try:
+            self.on_element(
+                locator,
+                lambda element: ActionChains(
+                    self.driver).move_to_element(element).perform())
+        except selenium_exceptions.NoSuchElementException:
+            logging.error('Exception : Not Able To Scroll to Element')
+        except BaseException:
+            self.on_element(
+                locator,
+                lambda element: self.driver.execute_script(
+                    "arguments[0].scrollIntoView(true)", element))
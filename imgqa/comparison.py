@@ -2,11 +2,626 @@
 """Comparison Module for Images, Files like CSV, Excel, PDF etc."""
 import unittest
 import cv2
+import filecmp
+import hashlib
+import itertools
+import json
+import numpy as np
 from skimage.measure import compare_ssim as ssim
 import logging
+import multiprocessing
 import pandas as pd
 from jsondiff import diff
 import os
+import time
+from imgqa.imagecache import ImageCache, MAX_CACHE_BYTES
+from imgqa import jsonstream, screenshots, tablediff
+
+IMAGE_RESULT_COLUMNS = ['source', 'target', 'score', 'tier', 'level',
+                        'cached', 'boxes', 'diff_path', 'elapsed', 'error']
+
+JSON_RESULT_COLUMNS = ['golden', 'actual', 'identical', 'changes', 'patches',
+                       'elapsed', 'error']
+
+HASH_SIZE = 8  # hash is HASH_SIZE x HASH_SIZE bits
+
+SSIM_WINDOW = 7  # smallest image side SSIM can be computed on
+
+_IMAGE_CACHES = {}
+
+
+def _read_image(path):
+    """Decode an image from disk.
+
+    :param path: image path.
+    :return: decoded BGR image.
+    :rtype: numpy.ndarray
+    """
+    image = cv2.imread(path)
+    if image is None:
+        raise IOError("Unable to read image '{}'".format(path))
+    return image
+
+
+def _load_image(image):
+    """Return the decoded image of a path, encoded bytes or array.
+
+    :param image: image path, PNG/JPEG bytes or decoded BGR image.
+    :rtype: numpy.ndarray
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if screenshots.is_encoded(image):
+        return screenshots.decode(image)
+    return _read_image(image)
+
+
+def _is_path(image):
+    """Return whether an image is given by its file path."""
+    return not isinstance(image, np.ndarray) and not screenshots.is_encoded(
+        image)
+
+
+def _content_hash(image, cache=None):
+    """Return the sha1 hex digest of an image path, bytes or array."""
+    if _is_path(image):
+        return cache.file_hash(image) if cache else None
+    if isinstance(image, np.ndarray):
+        sha1 = hashlib.sha1(str((image.shape, image.dtype.str)).encode())
+        sha1.update(np.ascontiguousarray(image).data)
+        return sha1.hexdigest()
+    return hashlib.sha1(bytes(image)).hexdigest()
+
+
+def _ssim(source, target, full=False):
+    """Return the SSIM of images, with the per pixel SSIM map when full.
+
+    :param source: decoded source image.
+    :param target: target image aligned to source.
+    :param full: also return the SSIM map averaged over channels.
+    :return: score, or (score, map)
+    :rtype: float or tuple
+    """
+    if not full:
+        return float(ssim(source, target, multichannel=True))
+    score, ssim_map = ssim(source, target, multichannel=True, full=True)
+    if ssim_map.ndim == 3:
+        ssim_map = ssim_map.mean(axis=2)
+    return float(score), ssim_map.astype(np.float32)
+
+
+def _changed_regions(ssim_map, threshold, min_area):
+    """Return bounding boxes of the regions scoring below threshold.
+
+    :param ssim_map: per pixel SSIM map.
+    :param threshold: SSIM below which a pixel is changed.
+    :param min_area: smallest box area(pixels) reported.
+    :return: list of [x, y, width, height] sorted top to bottom.
+    :rtype: list
+    """
+    changed = np.uint8(ssim_map < threshold) * 255
+    # Merge specks of the same change into one region.
+    changed = cv2.dilate(changed, None, iterations=2)
+    contours = cv2.findContours(
+        changed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    boxes = [[int(value) for value in cv2.boundingRect(contour)]
+             for contour in contours]
+    return sorted((box for box in boxes if box[2] * box[3] >= min_area),
+                  key=lambda box: (box[1], box[0]))
+
+
+def _write_diff(target, boxes, diff_path):
+    """Write target annotated with the changed regions.
+
+    :param target: target image aligned to source.
+    :param boxes: list of [x, y, width, height].
+    :param diff_path: png path written.
+    """
+    annotated = np.array(target)
+    for x, y, width, height in boxes:
+        cv2.rectangle(annotated, (x, y), (x + width, y + height),
+                      (0, 0, 255), 2)
+    if not cv2.imwrite(diff_path, annotated):
+        raise IOError("Unable to write diff image '{}'".format(diff_path))
+
+
+def _align_target(source, target):
+    """Resize target to the source resolution.
+
+    :param source: decoded source image.
+    :param target: decoded target image.
+    :return: resized copy of target.
+    :rtype: numpy.ndarray
+    """
+    return cv2.resize(
+        np.asarray(target), (int(source.shape[1]), int(source.shape[0])))
+
+
+def _ignored_mask(shape, include=None, exclude=None, scale=1.0):
+    """Return the mask of the pixels outside the compared regions.
+
+    :param shape: shape of the image masked.
+    :param include: (optional) list of (x, y, width, height) regions,
+        only these regions are compared.
+    :param exclude: (optional) list of (x, y, width, height) regions
+        ignored by the comparison.
+    :param scale: size of the image masked relative to the source the
+        regions are given in; scaled regions cover every pixel they
+        overlap.
+    :return: boolean mask of ignored pixels.
+    :rtype: numpy.ndarray
+    """
+    def box(region):
+        x, y, width, height = region
+        return (slice(int(y * scale), int(np.ceil((y + height) * scale))),
+                slice(int(x * scale), int(np.ceil((x + width) * scale))))
+    ignored = np.zeros(shape[:2], dtype=bool)
+    if include:
+        ignored[:] = True
+        for region in include:
+            ignored[box(region)] = False
+    for region in exclude or ():
+        ignored[box(region)] = True
+    return ignored
+
+
+def _mask_target(source, target, include=None, exclude=None):
+    """Make target match source outside the compared regions.
+
+    :param source: decoded source image.
+    :param target: target image aligned to source, modified in place.
+    :param include: (optional) regions compared, see _ignored_mask.
+    :param exclude: (optional) regions ignored, see _ignored_mask.
+    :return: boolean mask of ignored pixels.
+    :rtype: numpy.ndarray
+    """
+    ignored = _ignored_mask(source.shape, include, exclude)
+    target[ignored] = source[ignored]
+    return ignored
+
+
+def _tile_edges(length, tile_size):
+    """Split length into tile boundaries of tile_size.
+
+    A trailing tile smaller than the SSIM window is merged into the
+    previous one.
+    :param length: image height or width.
+    :param tile_size: tile edge in pixels.
+    :return: list of (start, stop).
+    :rtype: list
+    """
+    starts = list(range(0, length, tile_size))
+    if len(starts) > 1 and length - starts[-1] < SSIM_WINDOW:
+        starts.pop()
+    return list(zip(starts, starts[1:] + [length]))
+
+
+def _tiled_score(source, target, tile_size, ignored=None, fail_below=None,
+                 full=False):
+    """Score images tile by tile.
+
+    :param source: decoded source image.
+    :param target: target image aligned to source.
+    :param tile_size: tile edge in pixels.
+    :param ignored: (optional) boolean mask of ignored pixels, tiles
+        entirely ignored are not scored.
+    :param fail_below: (optional) stop at the first tile scoring below
+        this and return that tile score.
+    :param full: also return the SSIM map assembled from the tiles, tiles
+        not scored are 1.0.
+    :return: result with the area weighted score of tiles, the heatmap of
+        tile scores(None for tiles not scored) and the failed tile.
+    :rtype: dict
+    """
+    rows = _tile_edges(source.shape[0], tile_size)
+    columns = _tile_edges(source.shape[1], tile_size)
+    heatmap = [[None] * len(columns) for _ in rows]
+    result = {'tier': 'tiles', 'heatmap': heatmap, 'failed_tile': None}
+    if full:
+        result['ssim_map'] = np.ones(source.shape[:2], dtype=np.float32)
+    total = weight = 0.0
+    for row, (top, bottom) in enumerate(rows):
+        for column, (left, right) in enumerate(columns):
+            if ignored is not None and ignored[top:bottom, left:right].all():
+                continue
+            score = _ssim(source[top:bottom, left:right],
+                          target[top:bottom, left:right], full)
+            if full:
+                score, result['ssim_map'][top:bottom, left:right] = score
+            heatmap[row][column] = score
+            if fail_below is not None and score < fail_below:
+                result.update(score=score, failed_tile=[row, column])
+                return result
+            area = (bottom - top) * (right - left)
+            total += score * area
+            weight += area
+    result['score'] = total / weight if weight else 1.0
+    return result
+
+
+def _image_hash(image, method='dhash'):
+    """Return the perceptual hash of a decoded image.
+
+    :param image: decoded BGR image.
+    :param method: 'ahash', 'dhash' or 'phash'.
+    :return: HASH_SIZE x HASH_SIZE boolean array.
+    :rtype: numpy.ndarray
+    """
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_BGR2GRAY)
+    if method == 'ahash':
+        small = cv2.resize(gray, (HASH_SIZE, HASH_SIZE),
+                           interpolation=cv2.INTER_AREA)
+        return small > small.mean()
+    if method == 'dhash':
+        small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE),
+                           interpolation=cv2.INTER_AREA)
+        return small[:, 1:] > small[:, :-1]
+    if method == 'phash':
+        small = cv2.resize(gray, (HASH_SIZE * 4, HASH_SIZE * 4),
+                           interpolation=cv2.INTER_AREA)
+        low = cv2.dct(np.float32(small))[:HASH_SIZE, :HASH_SIZE]
+        return low > np.median(low)
+    raise ValueError("Unknown hash method '{}'".format(method))
+
+
+def _pyramid_score(source, target, scales, pass_above, fail_below=None,
+                   full=False, include=None, exclude=None):
+    """Score downsampled images from the coarsest scale up.
+
+    The target is resized straight to every scale, whatever its
+    resolution, so no full resolution copy of it is made.
+    :param source: decoded source image.
+    :param target: decoded target image.
+    :param scales: downsampling factors below 1.0, e.g. [0.125, 0.25].
+    :param pass_above: score deciding a pass at a coarse scale.
+    :param fail_below: (optional) score deciding a failure at a coarse
+        scale.
+    :param full: also return the SSIM map of the deciding scale, resized
+        to the source resolution.
+    :param include: (optional) regions compared, see _ignored_mask.
+    :param exclude: (optional) regions ignored, see _ignored_mask.
+    :return: result of the first scale whose score is not ambiguous, or
+        None when every scale is.
+    :rtype: dict
+    """
+    height, width = source.shape[:2]
+    target = np.asarray(target)
+    for scale in sorted(scales):
+        size = (int(width * scale), int(height * scale))
+        if scale >= 1 or min(size) < SSIM_WINDOW:
+            continue
+        small_source = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+        small_target = cv2.resize(target, size, interpolation=cv2.INTER_AREA)
+        if include or exclude:
+            ignored = _ignored_mask(small_source.shape, include, exclude,
+                                    scale)
+            small_target[ignored] = small_source[ignored]
+        score = _ssim(small_source, small_target, full)
+        if full:
+            score, ssim_map = score
+        if score >= pass_above or (
+                fail_below is not None and score < fail_below):
+            result = {'score': score, 'tier': 'pyramid', 'level': scale}
+            if full:
+                result['ssim_map'] = cv2.resize(ssim_map, (width, height))
+            return result
+    return None
+
+
+def _score_pair(source, target, prefilter=False, hash_method='dhash',
+                hash_threshold=0, tile_size=None, include=None,
+                exclude=None, fail_below=None, scales=None,
+                pass_above=0.99, diff=False, diff_threshold=0.9,
+                diff_min_area=16, diff_path=None):
+    """Score decoded images and return the result fields.
+
+    :param source: decoded source image.
+    :param target: decoded target image.
+    :param prefilter: skip SSIM when the perceptual hashes of the images
+        are within hash_threshold bits.
+    :param hash_method: 'ahash', 'dhash' or 'phash'.
+    :param hash_threshold: maximum Hamming distance between the hashes
+        of images taken as visually identical.
+    :param tile_size: (optional) score tiles of this edge, see _tiled_score.
+    :param include: (optional) regions compared, see _mask_target.
+    :param exclude: (optional) regions ignored, see _mask_target.
+    :param fail_below: (optional) tile score failing fast, see
+        _tiled_score, and score deciding a failure at a coarse scale.
+    :param scales: (optional) coarse scales compared first, see
+        _pyramid_score.
+    :param pass_above: score deciding a pass at a coarse scale.
+    :param diff: also return the SSIM map('ssim_map') computed by the
+        comparison and the boxes of the regions changed.
+    :param diff_threshold: SSIM below which a pixel is changed.
+    :param diff_min_area: smallest changed region(pixels) reported.
+    :param diff_path: (optional) png written with the changed regions
+        boxed on the target, only when there are changed regions.
+    :return: result with the score, the tier and the scale(level) that
+        decided it, json serializable unless diff is set.
+    :rtype: dict
+    """
+    full = bool(diff or diff_path)
+    result = None
+    if prefilter:
+        distance = int(np.count_nonzero(
+            _image_hash(source, hash_method) !=
+            _image_hash(target, hash_method)))
+        if distance <= hash_threshold:
+            result = {'score': 1.0, 'tier': 'hash', 'hash_distance': distance}
+    if result is None and scales:
+        result = _pyramid_score(source, target, scales, pass_above,
+                                fail_below, full, include, exclude)
+    if result is None:
+        # No coarse scale decided, compare at the source resolution.
+        target = _align_target(source, target)
+        ignored = None
+        if include or exclude:
+            ignored = _mask_target(source, target, include, exclude)
+        if tile_size:
+            result = _tiled_score(
+                source, target, tile_size, ignored, fail_below, full)
+        elif full:
+            score, ssim_map = _ssim(source, target, full)
+            result = {'score': score, 'tier': 'ssim', 'ssim_map': ssim_map}
+        else:
+            result = {'score': _ssim(source, target), 'tier': 'ssim'}
+        result['level'] = 1.0
+    if full:
+        result['boxes'] = []
+        if 'ssim_map' in result:
+            result['boxes'] = _changed_regions(
+                result['ssim_map'], diff_threshold, diff_min_area)
+        if diff_path and result['boxes']:
+            if np.shape(target)[:2] != source.shape[:2]:
+                target = _align_target(source, target)
+            _write_diff(target, result['boxes'], diff_path)
+            result['diff_path'] = diff_path
+    return result
+
+
+def _image_cache(cache_dir, max_bytes):
+    """Return the ImageCache of cache_dir shared within this process.
+
+    :param cache_dir: cache directory path.
+    :param max_bytes: size bound of the cache in bytes.
+    :rtype: ImageCache
+    """
+    cache = _IMAGE_CACHES.get(cache_dir)
+    if cache is None:
+        cache = _IMAGE_CACHES[cache_dir] = ImageCache(cache_dir, max_bytes)
+    cache.max_bytes = max_bytes
+    return cache
+
+
+def compare_image(source, target, cache_dir=None,
+                  cache_max_bytes=MAX_CACHE_BYTES, diff_dir=None, **params):
+    """Compare two images and return the result fields.
+
+    Images are file paths, or encoded bytes and decoded arrays held in
+    memory, e.g. screenshots, which are compared without touching disk.
+    With a cache_dir, a result computed before for the same image contents
+    is returned without decoding either image, and decoded source images
+    are memory mapped from the cache instead of decoded again. Results
+    with diff artifacts are not cached.
+    With prefilter, byte identical images are scored 1.0 without decoding.
+    :param source: source image path, bytes or array.
+    :param target: target image path, bytes or array.
+    :param cache_dir: (optional) ImageCache directory.
+    :param cache_max_bytes: size bound of the cache in bytes.
+    :param diff_dir: (optional) directory of the annotated diff png,
+        named diff_<target name>.png, diff_capture.png for targets held
+        in memory.
+    :param params: keyword options of _score_pair.
+    :return: result with score, tier and cached keys.
+    :rtype: dict
+    """
+    exact = {'score': 1.0, 'tier': 'exact', 'cached': False}
+    if diff_dir:
+        if not os.path.isdir(diff_dir):
+            os.makedirs(diff_dir)
+        name = os.path.splitext(os.path.basename(target))[0] \
+            if _is_path(target) else 'capture'
+        params['diff_path'] = os.path.join(diff_dir, 'diff_' + name + '.png')
+    artifacts = bool(params.get('diff') or diff_dir)
+    if artifacts:
+        exact['boxes'] = []
+    if cache_dir is None:
+        if params.get('prefilter'):
+            if _is_path(source) and _is_path(target):
+                if filecmp.cmp(source, target, shallow=False):
+                    return exact
+            elif _content_hash(source) == _content_hash(target):
+                return exact
+        result = _score_pair(_load_image(source), _load_image(target),
+                             **params)
+        result['cached'] = False
+        return result
+    cache = _image_cache(cache_dir, cache_max_bytes)
+    source_digest = _content_hash(source, cache)
+    target_digest = _content_hash(target, cache)
+    if params.get('prefilter') and source_digest == target_digest:
+        return exact
+    key = cache.result_key(source_digest, target_digest, params)
+    result = None if artifacts else cache.get_result(key)
+    if result is None:
+        source_image = cache.load_array(source, _read_image) \
+            if _is_path(source) else _load_image(source)
+        result = _score_pair(source_image, _load_image(target), **params)
+        if not artifacts:
+            cache.set_result(key, result)
+        result['cached'] = False
+    else:
+        result['cached'] = True
+    return result
+
+
+def _diff_sheet(source, target, sheet, unique_col):
+    """Parse a sheet of two open workbooks and return their difference.
+
+    :param source: source pandas.ExcelFile.
+    :param target: target pandas.ExcelFile.
+    :param sheet: sheet name.
+    :param unique_col: unique column name.
+    :return: sheet name, changed, removed and added data frames and the
+        read and diff seconds.
+    :rtype: tuple
+    """
+    start = time.time()
+    source_df = source.parse(sheet).fillna('NA')
+    target_df = target.parse(sheet).fillna('NA')
+    read_time = time.time() - start
+    start = time.time()
+    column_list = source_df.columns.tolist()
+
+    source_df['version'] = "source"
+    target_df['version'] = "target"
+
+    source_df.sort_values(by=unique_col)
+    source_df = source_df.reindex()
+    target_df.sort_values(by=unique_col)
+    target_df = target_df.reindex()
+
+    diff_output = tablediff.cell_diff(source_df, target_df, column_list)
+
+    full_set = pd.concat([source_df, target_df], ignore_index=True)
+    changes = full_set.drop_duplicates(subset=column_list, keep='last')
+    dupe_records = changes.set_index(unique_col).index.unique()
+
+    changes['duplicate'] = changes[unique_col].isin(dupe_records)
+    removed_parts = changes[(~changes["duplicate"]) & (
+        changes["version"] == "source")]
+    new_part_set = full_set.drop_duplicates(
+        subset=column_list, keep='last')
+    new_part_set['duplicate'] = new_part_set[unique_col].isin(dupe_records)
+    added_parts = new_part_set[(~new_part_set["duplicate"]) & (
+        new_part_set["version"] == "target")]
+
+    # Only include the columns we care about
+    return (sheet, diff_output, removed_parts[column_list],
+            added_parts[column_list], read_time, time.time() - start)
+
+
+def _diff_sheets(job):
+    """Parse sheets of two workbooks and return their differences.
+
+    Runs inside the worker processes of Compare.compare_files, so sheets
+    are parsed in parallel and only the differences are sent back. Each
+    workbook is opened once for all the sheets of the job, the seconds
+    opening them counted in the read seconds of the first sheet.
+    :param job: tuple of (sheet names, source workbook path, target
+        workbook path, unique column name).
+    :return: _diff_sheet result of every sheet, in order.
+    :rtype: list
+    """
+    sheets, source_path, target_path, unique_col = job
+    start = time.time()
+    with pd.ExcelFile(source_path) as source, \
+            pd.ExcelFile(target_path) as target:
+        open_time = time.time() - start
+        results = [_diff_sheet(source, target, sheet, unique_col)
+                   for sheet in sheets]
+    sheet, diff_output, removed, added, read_time, diff_time = results[0]
+    results[0] = (sheet, diff_output, removed, added, read_time + open_time,
+                  diff_time)
+    return results
+
+
+def _init_image_worker():
+    """Keep OpenCV single threaded inside pool workers."""
+    cv2.setNumThreads(1)
+
+
+def _compare_image_job(job):
+    """Compare one image pair and return its result row.
+
+    Runs inside the worker processes of Compare.iter_image_batch, so any
+    failure is reported in the row instead of being raised.
+
+    :param job: tuple of (index, source path, target path, options of
+        compare_image).
+    :return: result row.
+    :rtype: dict
+    """
+    index, source, target, options = job
+    row = dict((column, None) for column in IMAGE_RESULT_COLUMNS)
+    row.update(index=index, source=source, target=target)
+    start = time.time()
+    try:
+        row.update(compare_image(source, target, **options))
+        row.pop('ssim_map', None)
+    except Exception as exc:
+        row['error'] = '{}: {}'.format(type(exc).__name__, exc)
+    row['elapsed'] = time.time() - start
+    return row
+
+
+def _compare_json_job(job):
+    """Compare one golden json file with its actual capture.
+
+    Runs inside the worker processes of Compare.compare_json_dirs. Byte
+    identical files are not parsed; loaded files whose canonical forms
+    hash the same are not diffed. Streamed files are not hashed, which
+    would load them, stream_diff skipping identical branches instead.
+    The difference is always the path addressed patches of
+    jsonstream.diff_values, as compare_json returns with stream or keys.
+
+    :param job: tuple of (index, golden path, actual path, stream, keys).
+    :return: result row.
+    :rtype: dict
+    """
+    index, golden, actual, stream, keys = job
+    row = dict((column, None) for column in JSON_RESULT_COLUMNS)
+    row.update(index=index, golden=golden, actual=actual)
+    start = time.time()
+    try:
+        if golden is None or actual is None:
+            raise IOError("No {} file".format(
+                'golden' if golden is None else 'actual'))
+        if filecmp.cmp(golden, actual, shallow=False):
+            patches = []
+        elif stream:
+            patches = list(jsonstream.stream_diff(golden, actual, keys))
+        else:
+            with open(golden) as handle:
+                golden_value = json.load(handle)
+            with open(actual) as handle:
+                actual_value = json.load(handle)
+            if (jsonstream.subtree_hash(golden_value) ==
+                    jsonstream.subtree_hash(actual_value)):
+                patches = []
+            else:
+                patches = list(jsonstream.diff_values(
+                    golden_value, actual_value,
+                    keys=jsonstream.parse_keys(keys)))
+        row.update(identical=not patches, changes=len(patches),
+                   patches=patches)
+    except Exception as exc:
+        row['error'] = '{}: {}'.format(type(exc).__name__, exc)
+    row['elapsed'] = time.time() - start
+    return row
+
+
+def _iter_pool(function, jobs, processes=None, chunksize=1,
+               initializer=None):
+    """Run function over jobs in a process pool and yield each result.
+
+    Results are yielded as soon as they finish.
+    :param processes: number of worker processes, defaults to cpu count.
+        1 runs the jobs in the current process.
+    :rtype: generator
+    """
+    if processes == 1:
+        for job in jobs:
+            yield function(job)
+        return
+    pool = multiprocessing.Pool(processes, initializer)
+    try:
+        for result in pool.imap_unordered(function, jobs, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 class Compare(unittest.TestCase):
@@ -23,48 +638,232 @@ class Compare(unittest.TestCase):
         self.target_name = None
         self.image_extn = ('jpg', 'jpeg', "png")
         self.excel_extn = ('xls', 'xlsx')
-        self.file_extn = ('xls', 'xlsx', 'csv', 'tsv', 'hdf', 'html')
+        self.file_extn = ('xls', 'xlsx', 'csv', 'tsv', 'hdf', 'html',
+                          tablediff.SNAPSHOT_EXTN)
+        self.sheet_timings = {}
 
-    def compare_images(self, source, target):
+    def compare_images(self, source, target, details=False, **options):
         """Compare images and returns structural similarity over the image.
 
         Measure of SSIM is returned between 0-1.0 where 1.0 is
         the most identical
         and 0 being completely different
-        :param source: source image path.
-        :param target: target image path.
+        :param source: source image path, PNG/JPEG bytes or decoded BGR
+            array, e.g. an in-memory screenshot.
+        :param target: target image path, bytes or array.
+        :param details: return the whole result(score, tier, cached...)
+            instead of the score alone.
+        :param cache_dir: (optional) directory caching decoded source
+            images and scores by content hash, so unchanged pairs are
+            not decoded or compared again.
+        :param cache_max_bytes: size bound of the cache in bytes, least
+            recently used entries are evicted beyond it.
+        :param prefilter: compare in tiers, byte identical files ('exact')
+            and images whose perceptual hashes are within hash_threshold
+            ('hash') score 1.0 and only the rest are compared by SSIM
+            ('ssim').
+        :param hash_method: perceptual hash of the prefilter, 'ahash',
+            'dhash'(default) or 'phash'.
+        :param hash_threshold: maximum Hamming distance, out of 64 bits,
+            of images taken as visually identical(default 0).
+        :param tile_size: score tiles of this edge(pixels) instead of the
+            whole image, the result then has a 'heatmap' of tile scores.
+        :param include: list of (x, y, width, height) regions, only these
+            regions are compared.
+        :param exclude: list of (x, y, width, height) regions ignored,
+            e.g. a clock or an ad slot.
+        :param fail_below: with tile_size, stop at the first tile scoring
+            below this and return that tile score and its 'failed_tile'.
+            With scales, a coarse score below this decides a failure.
+        :param scales: downsampling factors, e.g. [0.125, 0.25, 0.5],
+            compared from the coarsest up before the full resolution. The
+            first scale scoring at least pass_above(or below fail_below)
+            decides the result and is reported as its 'level'.
+        :param pass_above: coarse score deciding a pass(default 0.99).
+        :param diff: also return the SSIM map('ssim_map') of the comparison
+            and the [x, y, width, height] 'boxes' of the changed regions,
+            from the same pass.
+        :param diff_threshold: SSIM below which a pixel is changed(default
+            0.9).
+        :param diff_min_area: smallest changed region reported(default 16
+            pixels).
+        :param diff_dir: write the target with its changed regions boxed
+            to diff_<target name>.png in this directory, when changed
+            regions are found. Implies diff.
         :return: SSIM difference of images which ranges between 0 and 1
         :rtype: float
         """
-        self.source = cv2.imread(source)
-        self.target = cv2.imread(target)
-        self.source_extn = source.split(".")[1]
-        self.target_extn = target.split(".")[1]
-        if self.source_extn and self.target_extn not in self.image_extn:
-            logging.error("Invalid image extension")
-        self.target = cv2.resize(
-            self.target, (int(self.source.shape[1]),
-                          int(self.source.shape[0])))
-        return ssim(self.source, self.target, multichannel=True)
-
-    def compare_json(self, source, target):
+        self.source = source
+        self.target = target
+        if _is_path(source) and _is_path(target):
+            self.source_extn = source.split(".")[1]
+            self.target_extn = target.split(".")[1]
+            if self.source_extn and self.target_extn not in self.image_extn:
+                logging.error("Invalid image extension")
+        result = compare_image(source, target, **options)
+        return result if details else result['score']
+
+    def iter_image_batch(self, pairs, processes=None, chunksize=1,
+                         **options):
+        """Compare image pairs in a process pool and yield each result.
+
+        Results are yielded as soon as they finish, so they do not follow
+        the order of pairs; use the 'index' key to map them back.
+        :param pairs: iterable of (source image path, target image path).
+        :param processes: number of worker processes, defaults to cpu count.
+            1 compares the pairs in the current process.
+        :param chunksize: number of pairs handed to a worker at once.
+        :param options: keyword options of compare_images.
+        :return: generator of result rows with index, source, target,
+            score, tier, level, cached, elapsed and error keys.
+        :rtype: generator
+        """
+        jobs = ((index, source, target, options)
+                for index, (source, target) in enumerate(pairs))
+        return _iter_pool(_compare_image_job, jobs, processes, chunksize,
+                          _init_image_worker)
+
+    def compare_image_batch(self, pairs, processes=None, chunksize=1,
+                            **options):
+        """Compare image pairs in a process pool.
+
+        :param pairs: iterable of (source image path, target image path).
+        :param processes: number of worker processes, defaults to cpu count.
+        :param chunksize: number of pairs handed to a worker at once.
+        :param options: keyword options of compare_images.
+        :return: one row per pair with source, target, score, tier,
+            level, cached, elapsed (seconds) and error columns, in the
+            order of pairs.
+        :rtype: data frame.
+        """
+        rows = list(self.iter_image_batch(
+            pairs, processes, chunksize, **options))
+        results = pd.DataFrame(rows, columns=['index'] + IMAGE_RESULT_COLUMNS)
+        return results.sort_values('index').set_index('index')
+
+    def compare_image_dirs(self, baseline_dir, candidate_dir,
+                           processes=None, chunksize=1, **options):
+        """Compare every baseline image with the same named candidate.
+
+        Baselines missing from the candidate directory are reported
+        through the error column.
+        :param baseline_dir: directory of baseline images.
+        :param candidate_dir: directory of candidate images.
+        :param processes: number of worker processes, defaults to cpu count.
+        :param chunksize: number of pairs handed to a worker at once.
+        :param options: keyword options of compare_images.
+        :return: one row per baseline image, see compare_image_batch.
+        :rtype: data frame.
+        """
+        names = sorted(
+            name for name in os.listdir(baseline_dir)
+            if name.rsplit('.', 1)[-1].lower() in self.image_extn)
+        pairs = [(os.path.join(baseline_dir, name),
+                  os.path.join(candidate_dir, name)) for name in names]
+        return self.compare_image_batch(
+            pairs, processes, chunksize, **options)
+
+    def compare_json(self, source, target, stream=False, keys=None):
         """Compare json files.
 
         :param source: source json.
         :param target: target json.
-        :return: difference of target compared to source
+        :param stream: (optional) source and target are json file paths or
+            binary file objects parsed incrementally, for documents too
+            large to load. Requires ijson.
+        :param keys: (optional) identity keys of arrays of records, like
+            'items[*].id'. Keyed arrays are diffed by record in linear
+            time, whatever their order, into added, removed and modified
+            records addressed by key instead of position. Without stream,
+            source and target are loaded json values.
+        :return: difference of target compared to source, or with stream or
+            keys path addressed patches({'op', 'path', 'old', 'value'}).
         :rtype: Dictionary
         """
+        if stream:
+            return jsonstream.stream_diff(source, target, keys)
+        if keys:
+            return list(jsonstream.diff_values(
+                source, target, keys=jsonstream.parse_keys(keys)))
         return diff(source, target)
 
-    def compare_files(self, source, target):
+    def compare_json_dirs(self, golden_dir, actual_dir, processes=None,
+                          chunksize=1, stream=False, keys=None):
+        """Compare every golden json file with the same named actual file.
+
+        Pairs are diffed in a process pool, byte identical pairs being
+        skipped, and without stream also pairs whose canonical forms(key
+        order and whitespace aside) hash the same. Streamed pairs are not
+        hashed, as that would load them; stream_diff skips their
+        identical branches instead.
+        Differences are path addressed patches({'op', 'path', 'old',
+        'value'}) with or without stream and keys, as compare_json returns
+        with stream or keys, not the jsondiff output of compare_json
+        without them: patches are counted per change in the changes
+        column and are the same whether the files are streamed or not.
+        Files found in only one directory are reported through the error
+        column.
+        :param golden_dir: directory of golden json files.
+        :param actual_dir: directory of actual json files.
+        :param processes: number of worker processes, defaults to cpu count.
+            1 compares the files in the current process.
+        :param chunksize: number of pairs handed to a worker at once.
+        :param stream: parse the files incrementally, see compare_json.
+        :param keys: identity keys of arrays, see compare_json.
+        :return: one row per file name with golden, actual, identical,
+            changes(number of patches), patches, elapsed (seconds) and
+            error columns.
+        :rtype: data frame.
+        """
+        golden = set(name for name in os.listdir(golden_dir)
+                     if name.lower().endswith('.json'))
+        actual = set(name for name in os.listdir(actual_dir)
+                     if name.lower().endswith('.json'))
+        names = sorted(golden | actual)
+        jobs = ((index,
+                 os.path.join(golden_dir, name) if name in golden else None,
+                 os.path.join(actual_dir, name) if name in actual else None,
+                 stream, keys)
+                for index, name in enumerate(names))
+        rows = sorted(_iter_pool(_compare_json_job, jobs, processes,
+                                 chunksize), key=lambda row: row['index'])
+        results = pd.DataFrame(rows, columns=JSON_RESULT_COLUMNS)
+        results.index = pd.Index(names, name='name')
+        return results
+
+    def compare_files(self, source, target, chunksize=None,
+                      hash_columns=None, keys=None, processes=None,
+                      sink=None, out_dir=None):
         """Compare two files and return difference(if any).
 
-        File Types Supported: xls or xlsx or html or hdf or csv or tsv
+        File Types Supported: xls or xlsx or html or hdf or csv or tsv or
+        arrow(snapshot from create_snapshot)
+        The difference tables are streamed to sink, every run writing to
+        new file_diff_<time>_<id> files of out_dir.
         :param source: Source file Path.
         :param target: Target file path.
-        :return: file difference
-        :rtype: data frame of file difference.
+        :param chunksize: (optional) csv, tsv and snapshot only, diff the files
+            chunksize rows at a time through hashed rows spilled to disk,
+            so memory is bounded by chunksize instead of the file size.
+            Removed and added rows are written to the 'removed' and 'added'
+            tables, csv files by default.
+        :param hash_columns: (optional) with chunksize, columns identifying
+            a row, defaults to all columns.
+        :param keys: (optional) non workbook files only, key columns
+            matching source and target rows. Rows are returned as
+            'removed', 'added' and 'modified'(source and target values
+            side by side) data frames, with 'changes', the per column
+            change mask of the modified rows.
+        :param processes: (optional) xls and xlsx only, number of processes
+            diffing sheets, defaults to one per sheet up to the cpu count.
+        :param sink: (optional) 'xlsx', 'csv', 'jsonl', 'parquet',
+            'memory' or a tablediff.DiffSink, defaults to 'csv' with
+            chunksize, 'memory' with keys and 'xlsx' otherwise.
+        :param out_dir: (optional) directory of the difference files,
+            defaults to the source directory.
+        :return: table name to file path, or data frame with 'memory'.
+            With chunksize also the removed and added row counts.
+        :rtype: dict
         """
         self.source = source
         self.target = target
@@ -72,123 +871,172 @@ class Compare(unittest.TestCase):
         self.target_extn = target.split('.')[1]
         self.source_name = source.split('.')[0]
         self.target_name = target.split('.')[0]
+        if out_dir is None:
+            out_dir = os.path.dirname(source) or '.'
         if self.source_extn and self.target_extn in self.file_extn:
             if self.source_extn and self.target_extn in self.excel_extn:
-                return self.__compare_workbooks()
+                sink = tablediff.make_sink(sink or 'xlsx', out_dir)
+                self.__compare_workbooks(sink, processes)
+            elif chunksize:
+                sink = tablediff.make_sink(sink or 'csv', out_dir)
+                counts = self.__compare_streaming(
+                    sink, chunksize, hash_columns)
+                result = sink.close()
+                result.update(counts)
+                return result
             else:
                 self.source_data = self.__load_into_dataframe(source)
                 self.target_data = self.__load_into_dataframe(target)
-                return self.__compare_non_workbook_files()
+                if keys:
+                    sink = tablediff.make_sink(sink or 'memory', out_dir)
+                    for name, frame in tablediff.keyed_diff(
+                            self.source_data, self.target_data,
+                            keys).items():
+                        # Only the modified rows carry the key index.
+                        sink.write(name, frame,
+                                   index=name in ('modified', 'changes'))
+                else:
+                    sink = tablediff.make_sink(sink or 'xlsx', out_dir)
+                    self.__compare_non_workbook_files(sink)
+            return sink.close()
         else:
             logging.error('File Extension not supported')
 
-    def __compare_workbooks(self):
-        """Compare two xls or xlsx files and return difference and boolean.
+    def __compare_workbooks(self, sink, processes=None,
+                            unique_col="account number"):
+        """Compare two xls or xlsx files and write their difference.
 
-        :return: True/False.
-        :rtype: bool.
-        """
-        source_df = pd.ExcelFile(self.source)
-        target_df = pd.ExcelFile(self.target)
-
-        if source_df.sheet_names == target_df.sheet_names:
-            for sheet in source_df.sheet_names:
-                self.__compare_sheets(sheet)
-
-    def __compare_sheets(self, sheet, unique_col="account number"):
-        """Compare sreadsheets and return difference to xl file.
-
-        :param sheet: sheet name
+        Sheets are parsed and diffed in a process pool, each worker
+        opening the two workbooks once for a run of consecutive sheets,
+        and every sheet is written to sink in workbook order as soon as it
+        and the sheets before it are diffed. The sheet names are read from
+        the workbooks opened here, which also serve the sheets when
+        diffing in this process.
+        :param sink: DiffSink of the difference.
+        :param processes: number of processes diffing sheets, defaults to
+            one per sheet up to the cpu count. 1 diffs in this process.
         :param unique_col: column name
-        :return:
-        """
-        source_df = pd.read_excel(self.source, sheet).fillna('NA')
-        target_df = pd.read_excel(self.target, sheet).fillna('NA')
-        file_path = os.path.dirname(self.source)
-
-        column_list = source_df.columns.tolist()
-
-        source_df['version'] = "source"
-        target_df['version'] = "target"
-
-        source_df.sort_values(by=unique_col)
-        source_df = source_df.reindex()
-        target_df.sort_values(by=unique_col)
-        target_df = target_df.reindex()
-
-        # full_set = pd.concat([source_df, target_df], ignore_index=True)
-        diff_panel = pd.concat([source_df, target_df],
-                               axis='columns', keys=['df1', 'df2'],
-                               join='outer', sort=False)
-        diff_output = diff_panel.apply(self.__report_diff, axis=0)
-        diff_output['has_change'] = diff_output.apply(self.__has_change)
-
-        full_set = pd.concat([source_df, target_df], ignore_index=True)
-        changes = full_set.drop_duplicates(subset=column_list, keep='last')
-        dupe_records = changes.set_index(unique_col).index.unique()
-
-        changes['duplicate'] = changes[unique_col].isin(dupe_records)
-        removed_parts = changes[(~changes["duplicate"]) & (
-            changes["version"] == "source")]
-        new_part_set = full_set.drop_duplicates(
-            subset=column_list, keep='last')
-        new_part_set['duplicate'] = new_part_set[unique_col].isin(dupe_records)
-        added_parts = new_part_set[(~new_part_set["duplicate"]) & (
-            new_part_set["version"] == "target")]
-
-        # Save the changes to excel but only include the columns we care about
-        diff_file = file_path + "file_diff.xlsx"
-        if os.path.exists(diff_file):
-            os.remove(diff_file)
-        writer = pd.ExcelWriter(file_path + "file_diff.xlsx")
-        diff_output.to_excel(writer, "changed")
-        removed_parts.to_excel(
-            writer, "removed", index=False, columns=column_list)
-        added_parts.to_excel(writer, "added", index=False, columns=column_list)
-        writer.save()
-
-    def __report_diff(self, x):
-        """Report data difference.
-
-        :param x:
-        :return: difference
-        """
-        return x[0] if x[0] == x[1] else '{} ---> {}'.format(*x)
-
-    def __has_change(self, row):
-        """Return Yes if cell has different data else No.
-
-        :param row: row data
-        :return: Yes/No
-        """
-        if "--->" in row:
-            return "Yes"
-        else:
-            return "No"
+        :return: per sheet read, diff and write seconds, also kept in
+            self.sheet_timings.
+        :rtype: dict.
+        """
+        self.sheet_timings = {}
+        with pd.ExcelFile(self.source) as source, \
+                pd.ExcelFile(self.target) as target:
+            sheets = source.sheet_names
+            if sheets != target.sheet_names:
+                return self.sheet_timings
+            if processes is None:
+                processes = min(len(sheets), multiprocessing.cpu_count())
+            if processes > 1:
+                # Consecutive sheets per worker, each opening the two
+                # workbooks once.
+                size = -(-len(sheets) // processes)
+                jobs = [(sheets[index:index + size], self.source,
+                         self.target, unique_col)
+                        for index in range(0, len(sheets), size)]
+                pool = multiprocessing.Pool(len(jobs))
+                results = itertools.chain.from_iterable(
+                    pool.imap(_diff_sheets, jobs))
+            else:
+                pool = None
+                results = (_diff_sheet(source, target, sheet, unique_col)
+                           for sheet in sheets)
+            try:
+                for (sheet, diff_output, removed_parts, added_parts,
+                     read_time, diff_time) in results:
+                    start = time.time()
+                    # Single sheet workbooks keep plain table names.
+                    prefix = sheet + ' ' if len(sheets) > 1 else ''
+                    sink.write(prefix + "changed", diff_output, index=True)
+                    sink.write(prefix + "removed", removed_parts)
+                    sink.write(prefix + "added", added_parts)
+                    self.sheet_timings[sheet] = dict(
+                        read=read_time, diff=diff_time,
+                        write=time.time() - start)
+                if pool is not None:
+                    pool.close()
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+        return self.sheet_timings
 
-    def __compare_non_workbook_files(self):
-        """Return xl of spreadsheet difference.
+    def __compare_non_workbook_files(self, sink):
+        """Write the rows found in only one of the files.
 
-        :return: True/False.
-        :rtype: bool.
+        :param sink: DiffSink of the difference.
         """
         df = pd.concat([self.source_data, self.target_data])
         df = df.reset_index(drop=True)
         df_groupby = df.groupby(list(df.columns))
         index = [x[0] for x in df_groupby.groups.values() if len(x) == 1]
         diff = df.reindex(index)
+        sink.write("difference", diff, index=True)
+
+    def __compare_streaming(self, sink, chunksize, hash_columns=None):
+        """Diff csv or tsv files chunk by chunk.
 
-        # Save the changes to excel
-        file_path = os.path.dirname(self.source)
-        diff_file = file_path + "file_diff.xlsx"
-        if os.path.exists(diff_file):
-            os.remove(diff_file)
-        writer = pd.ExcelWriter(file_path + "file_diff.xlsx")
-        diff.to_excel(writer, "difference")
-        writer.save()
+        :param sink: DiffSink of the removed and added rows.
+        :param chunksize: rows read at once.
+        :param hash_columns: columns identifying a row.
+        :return: removed and added row counts.
+        :rtype: dict
+        """
+        streamed = tuple(tablediff.SEPARATORS) + (tablediff.SNAPSHOT_EXTN,)
+        if (self.source_extn not in streamed or
+                self.target_extn not in streamed):
+            raise AssertionError(
+                "Chunked comparison supports csv, tsv and snapshot files only")
+        return tablediff.stream_diff(
+            self.source, self.target, sink,
+            source_sep=tablediff.SEPARATORS.get(self.source_extn),
+            target_sep=tablediff.SEPARATORS.get(self.target_extn),
+            chunksize=chunksize, columns=hash_columns)
+
+    def create_snapshot(self, source, snapshot=None, hash_columns=None,
+                        sheet=0):
+        """Convert a baseline file into a columnar snapshot.
+
+        The snapshot is an Arrow file(requires pyarrow) with the row
+        hashes precomputed. Passed to compare_files instead of the
+        baseline, it is memory mapped rather than parsed, and chunked
+        comparisons use its hashes instead of hashing the baseline again.
+        Hashes of parsed xls, xlsx, hdf or html values only match those of
+        other such snapshots in chunked comparisons, not csv/tsv text.
+        File Types Supported: xls or xlsx or html or hdf or csv or tsv
+        :param source: baseline file path.
+        :param snapshot: (optional) snapshot path, defaults to the
+            baseline path with an .arrow extension.
+        :param hash_columns: (optional) columns identifying a row, as
+            passed to compare_files with chunksize.
+        :param sheet: sheet name or index of xls or xlsx baselines.
+        :return: snapshot path.
+        :rtype: str
+        """
+        extn = source.rsplit('.', 1)[-1]
+        if extn in self.excel_extn:
+            frame = pd.read_excel(source, sheet)
+        elif extn in self.file_extn and extn != tablediff.SNAPSHOT_EXTN:
+            frame = self.__load_into_dataframe(source)
+        else:
+            raise AssertionError(
+                "Snapshot of '{}' files not supported".format(extn))
+        if extn in tablediff.SEPARATORS:
+            hashes = tablediff.file_hashes(
+                source, tablediff.SEPARATORS[extn], hash_columns)
+            hashed = 'file'
+        else:
+            hashes = tablediff.text_hashes(frame, hash_columns)
+            hashed = 'values'
+        snapshot = snapshot or '{}.{}'.format(
+            os.path.splitext(source)[0], tablediff.SNAPSHOT_EXTN)
+        tablediff.write_snapshot(frame, hashes, snapshot, hash_columns,
+                                 hashed)
+        return snapshot
 
     def __load_into_dataframe(self, data):
-        """Load hdf or csv or tsv file and return data.
+        """Load hdf or csv or tsv or snapshot file and return data.
 
         :param data: file.
         :return: file data.
@@ -202,6 +1050,8 @@ class Compare(unittest.TestCase):
             return self.__read_html(data)
         elif data.split(".")[1] == 'tsv':
             return self.__read_tsv(data)
+        elif data.split(".")[1] == tablediff.SNAPSHOT_EXTN:
+            return tablediff.read_snapshot(data)
 
     def __read_csv(self, data, sep=None):
         """Load csv file and return data.
@@ -0,0 +1,337 @@
+"""Pool of reusable selenium WebDriver sessions."""
+import logging
+import os
+import threading
+
+from selenium import webdriver
+from selenium.common import exceptions as selenium_exceptions
+from selenium.webdriver.chrome.options import Options
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+POOL_SIZE = 1  # sessions
+
+MAX_USES = 50  # leases of a session before it is recycled
+
+LEASE_TIME_OUT = 300  # Seconds
+
+RESET_URL = 'about:blank'
+
+PROFILE_ENV = 'IMGQA_BROWSER_PROFILE'  # browser profile of sessions
+
+WINDOW_SIZE = (1366, 768)  # Pixels
+
+# Analytics, ads and web fonts functional checks do not need.
+BLOCKED_URLS = (
+    '*google-analytics.com/*', '*googletagmanager.com/*',
+    '*doubleclick.net/*', '*connect.facebook.net/*',
+    '*fonts.googleapis.com/*', '*fonts.gstatic.com/*',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+)
+
+DEFAULT_PROFILE = {
+    'headless': False,
+    'images': True,  # load images
+    'blocked_urls': (),  # url patterns failed through DevTools
+    'page_load_strategy': 'normal',  # 'normal', 'eager' or 'none'
+    'window_size': None,  # (width, height)
+}
+
+# Browser profiles, trading fidelity for speed; settings missing from a
+# profile are those of DEFAULT_PROFILE.
+PROFILES = {
+    'default': {},
+    'headless': {'headless': True, 'window_size': WINDOW_SIZE},
+    'fast': {'headless': True, 'images': False,
+             'blocked_urls': BLOCKED_URLS, 'page_load_strategy': 'eager',
+             'window_size': WINDOW_SIZE},
+    'fastest': {'headless': True, 'images': False,
+                'blocked_urls': BLOCKED_URLS, 'page_load_strategy': 'none',
+                'window_size': WINDOW_SIZE},
+}
+
+CLEAR_STORAGE_SCRIPT = '''
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+'''
+
+
+def browser_profile(profile=None):
+    """Return the settings of a browser profile.
+
+    :param profile: PROFILES name, defaults to the PROFILE_ENV environment
+        variable, else 'default'.
+    :return: headless, images, blocked_urls, page_load_strategy and
+        window_size settings.
+    :rtype: dict
+    """
+    name = profile or os.environ.get(PROFILE_ENV) or 'default'
+    try:
+        settings = PROFILES[name]
+    except KeyError:
+        raise ValueError("Unknown browser profile '{}', expected one of "
+                         "{}".format(name, sorted(PROFILES)))
+    unknown = set(settings) - set(DEFAULT_PROFILE)
+    if unknown:
+        raise ValueError("Unknown settings {} of browser profile "
+                         "'{}'".format(sorted(unknown), name))
+    profile_settings = dict(DEFAULT_PROFILE)
+    profile_settings.update(settings)
+    return profile_settings
+
+
+def chrome(headless=False, profile=None):
+    """Start a Chrome session.
+
+    :param headless: run Chrome without a window, whatever the profile.
+    :param profile: PROFILES name, see browser_profile.
+    :return: WebDriver session.
+    """
+    settings = browser_profile(profile)
+    options = Options()
+    if headless or settings['headless']:
+        options.add_argument('--headless')
+        options.add_argument('--disable-gpu')
+    if not settings['images']:
+        options.add_experimental_option(
+            'prefs', {'profile.managed_default_content_settings.images': 2})
+    options.set_capability('pageLoadStrategy',
+                           settings['page_load_strategy'])
+    driver = webdriver.Chrome(options=options)
+    if settings['window_size']:
+        driver.set_window_size(*settings['window_size'])
+    if settings['blocked_urls']:
+        block_urls(driver, settings['blocked_urls'])
+    return driver
+
+
+def block_urls(driver, patterns):
+    """Fail the requests of a Chrome session to matching urls.
+
+    :param driver: Chrome WebDriver session.
+    :param patterns: url patterns, '*' matching any characters.
+    """
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs',
+                               {'urls': list(patterns)})
+    except (AttributeError, selenium_exceptions.WebDriverException) as exc:
+        logging.warning("Urls are not blocked, DevTools is unavailable: %s",
+                        exc)
+
+
+class DriverPool(object):
+    """Lease WebDriver sessions instead of starting a browser per test.
+
+    Up to size sessions are started, on demand or ahead of time with
+    prewarm, and leased one test at a time. A released session gets its
+    extra windows closed, its cookies and storage cleared and is leased
+    again, until it served max_uses leases or it stops responding, when it
+    is quit and replaced by a new one.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_uses=MAX_USES, factory=None,
+                 prewarm=False):
+        """Create the pool.
+
+        :param size: maximum number of sessions.
+        :param max_uses: leases of a session before it is recycled.
+        :param factory: callable returning a new WebDriver, defaults to
+            chrome.
+        :param prewarm: start the size sessions right away.
+        """
+        self.size = size
+        self.max_uses = max_uses
+        self.factory = factory or chrome
+        self.idle = queue.Queue()
+        self.uses = {}
+        self.lock = threading.Lock()
+        if prewarm:
+            self.prewarm()
+
+    def prewarm(self):
+        """Start the missing sessions in parallel and keep them idle."""
+        with self.lock:
+            missing = self.size - len(self.uses)
+            # Reserved so concurrent leases do not start extra sessions.
+            reserved = [object() for _ in range(missing)]
+            for token in reserved:
+                self.uses[id(token)] = 0
+        threads = [threading.Thread(target=self.__start_idle, args=(token,))
+                   for token in reserved]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def lease(self, timeout=LEASE_TIME_OUT):
+        """Return an idle session, starting one while below size.
+
+        :param timeout: seconds to wait for a session when all are leased.
+        :return: WebDriver session.
+        """
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                driver = self.__start() or self.__wait(timeout)
+            if self.__alive(driver):
+                return driver
+            self.__discard(driver)
+
+    def release(self, driver):
+        """Reset a leased session and return it to the pool.
+
+        Sessions that served max_uses leases or fail to reset are quit.
+        :param driver: session returned by lease.
+        """
+        with self.lock:
+            if id(driver) not in self.uses:
+                return
+            self.uses[id(driver)] += 1
+            worn_out = self.uses[id(driver)] >= self.max_uses
+        reset = False
+        try:
+            reset = not worn_out and self.reset(driver)
+        finally:
+            if reset:
+                self.idle.put(driver)
+            else:
+                self.__discard(driver)
+
+    def reset(self, driver):
+        """Close extra windows and clear cookies and storage of a session.
+
+        Chrome sessions are cleared through DevTools: every cookie, and the
+        storage of every origin the windows navigated to. Other sessions,
+        or when DevTools fails, get the cookies and storage of the first
+        window's origin cleared.
+        :param driver: WebDriver session.
+        :return: whether the session was reset.
+        :rtype: bool
+        """
+        try:
+            handles = driver.window_handles
+            origins = set()
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                origins.update(self.__visited_origins(driver))
+                driver.close()
+            driver.switch_to.window(handles[0])
+            origins.update(self.__visited_origins(driver))
+            if not self.__clear_browser_data(driver, origins):
+                driver.execute_script(CLEAR_STORAGE_SCRIPT)
+                driver.delete_all_cookies()
+            driver.get(RESET_URL)
+            return True
+        except Exception as exc:
+            # Dead sessions raise connection errors(urllib3, OSError), not
+            # only WebDriverException.
+            logging.warning("Recycling session that failed to reset: %s",
+                            exc)
+            return False
+
+    def close(self):
+        """Quit the idle sessions."""
+        while True:
+            try:
+                self.__discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def __start(self):
+        """Start a session if the pool is below size, else return None."""
+        with self.lock:
+            if len(self.uses) >= self.size:
+                return None
+            token = object()
+            self.uses[id(token)] = 0
+        return self.__replace(token)
+
+    def __start_idle(self, token):
+        """Start a session in place of a reservation and keep it idle."""
+        driver = self.__replace(token)
+        if driver is not None:
+            self.idle.put(driver)
+
+    def __replace(self, token):
+        """Start a session in place of a reservation token."""
+        try:
+            driver = self.factory()
+        except Exception:
+            with self.lock:
+                del self.uses[id(token)]
+            raise
+        with self.lock:
+            del self.uses[id(token)]
+            self.uses[id(driver)] = 0
+        return driver
+
+    def __wait(self, timeout):
+        """Wait for a released session."""
+        try:
+            return self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise AssertionError(
+                "No browser session released within {} seconds".format(
+                    timeout))
+
+    def __alive(self, driver):
+        """Return whether a session still responds."""
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def __visited_origins(self, driver):
+        """Return the http(s) origins of the current window's history."""
+        execute = getattr(driver, 'execute_cdp_cmd', None)
+        if execute is None:
+            return set()
+        try:
+            history = execute('Page.getNavigationHistory', {})
+        except selenium_exceptions.WebDriverException:
+            return set()
+        origins = set()
+        for entry in history.get('entries', ()):
+            url = urlsplit(entry.get('url', ''))
+            if url.scheme in ('http', 'https') and url.netloc:
+                origins.add('{}://{}'.format(url.scheme, url.netloc))
+        return origins
+
+    def __clear_browser_data(self, driver, origins):
+        """Clear every cookie and the storage of origins through DevTools.
+
+        :return: whether DevTools cleared them.
+        """
+        execute = getattr(driver, 'execute_cdp_cmd', None)
+        if execute is None:
+            return False
+        try:
+            execute('Network.clearBrowserCookies', {})
+            for origin in sorted(origins):
+                execute('Storage.clearDataForOrigin',
+                        {'origin': origin, 'storageTypes': 'all'})
+            return True
+        except selenium_exceptions.WebDriverException as exc:
+            logging.info("Clearing session data without DevTools: %s", exc)
+            return False
+
+    def __discard(self, driver):
+        """Quit a session and free its place in the pool."""
+        with self.lock:
+            self.uses.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            logging.info("Session %s already ended",
+                         getattr(driver, 'session_id', None))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Content addressed on-disk cache for image comparison."""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+MAX_CACHE_BYTES = 1 << 30  # 1 GB
+
+HASH_BLOCK_SIZE = 1 << 20  # 1 MB
+
+
+class ImageCache(object):
+    """Cache decoded images and comparison results by content hash.
+
+    Decoded images are kept as .npy files so they are memory mapped back
+    instead of decoded again, and results are kept as small json files
+    keyed on the source hash, target hash and comparison parameters.
+    The least recently used entries are evicted once the cache grows
+    beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES):
+        """Create the cache directories if they do not exist.
+
+        :param cache_dir: cache directory path.
+        :param max_bytes: size bound of the cache in bytes.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.array_dir = os.path.join(cache_dir, 'arrays')
+        self.result_dir = os.path.join(cache_dir, 'results')
+        for directory in (self.array_dir, self.result_dir):
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Created meanwhile by another worker process.
+                    if not os.path.isdir(directory):
+                        raise
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}
+        self._written = 0
+
+    def file_hash(self, path):
+        """Return the sha1 hex digest of a file content.
+
+        Digests are remembered per path, size and modification time so a
+        file is read at most once while it is unchanged.
+        :param path: file path.
+        :return: hex digest.
+        :rtype: str
+        """
+        stat = os.stat(path)
+        memo_key = (path, stat.st_size, stat.st_mtime)
+        if memo_key not in self._digests:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as handle:
+                for block in iter(
+                        lambda: handle.read(HASH_BLOCK_SIZE), b''):
+                    sha1.update(block)
+            self._digests[memo_key] = sha1.hexdigest()
+        return self._digests[memo_key]
+
+    def result_key(self, source_digest, target_digest, params=None):
+        """Return the cache key of a comparison result.
+
+        :param source_digest: content hash of the source image.
+        :param target_digest: content hash of the target image.
+        :param params: json serializable comparison parameters.
+        :return: hex digest.
+        :rtype: str
+        """
+        payload = json.dumps([source_digest, target_digest, params or {}],
+                             sort_keys=True)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def load_array(self, path, decode):
+        """Return the decoded image of path, decoding only on a miss.
+
+        :param path: image path.
+        :param decode: callable decoding an image path into an array.
+        :return: read only memory mapped array.
+        :rtype: numpy.ndarray
+        """
+        entry = os.path.join(self.array_dir, self.file_hash(path) + '.npy')
+        if os.path.exists(entry):
+            try:
+                array = np.load(entry, mmap_mode='r')
+                self.__touch(entry)
+                self.hits += 1
+                return array
+            except (IOError, ValueError):
+                logging.warning("Discarding corrupt cache entry %s", entry)
+        self.misses += 1
+        array = decode(path)
+        self.__write(entry, lambda handle: np.save(handle, array))
+        return array
+
+    def get_result(self, key):
+        """Return a cached comparison result or None.
+
+        :param key: key returned by result_key.
+        :return: cached result.
+        :rtype: dict
+        """
+        entry = os.path.join(self.result_dir, key + '.json')
+        try:
+            with open(entry) as handle:
+                result = json.load(handle)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.__touch(entry)
+        self.hits += 1
+        return result
+
+    def set_result(self, key, result):
+        """Store a comparison result.
+
+        :param key: key returned by result_key.
+        :param result: json serializable result.
+        """
+        entry = os.path.join(self.result_dir, key + '.json')
+        payload = json.dumps(result).encode('utf-8')
+        self.__write(entry, lambda handle: handle.write(payload))
+
+    def size(self):
+        """Return the total size of the cache entries in bytes."""
+        return sum(size for _, size, _ in self.__entries())
+
+    def evict(self):
+        """Remove least recently used entries until within max_bytes."""
+        entries = sorted(self.__entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._written = 0
+
+    def __entries(self):
+        """Yield (path, size, last use time) of every cache entry."""
+        for directory in (self.array_dir, self.result_dir):
+            for name in os.listdir(directory):
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def __touch(self, path):
+        """Mark an entry as recently used."""
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def __write(self, path, dump):
+        """Write an entry atomically and evict when the cache has grown.
+
+        :param path: entry path.
+        :param dump: callable writing the entry into an open binary file.
+        """
+        handle, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                dump(temp_file)
+            size = os.path.getsize(temp_path)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        except OSError:
+            # Another worker wrote the same entry first.
+            return
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        self._written += size
+        if self._written > self.max_bytes // 10:
+            self.evict()
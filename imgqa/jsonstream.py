@@ -0,0 +1,384 @@
+"""Streaming structural diff of large json documents."""
+import hashlib
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCALAR_EVENTS = ('null', 'boolean', 'number', 'string')
+
+
+def pointer(path):
+    """Return the json pointer(RFC 6901) of a path.
+
+    :param path: sequence of object keys and array indexes.
+    :rtype: str
+    """
+    return ''.join(
+        '/' + str(part).replace('~', '~0').replace('/', '~1')
+        for part in path)
+
+
+def subtree_hash(value):
+    """Return the sha1 hex digest of the canonical form of a json value.
+
+    Objects hash the same whatever their key order.
+    """
+    return hashlib.sha1(json.dumps(
+        value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+def parse_keys(keys):
+    """Parse identity keys of json arrays.
+
+    A key spec names an array path, '[*]' standing for any array element,
+    and the member identifying its records: 'items[*].id' keys the
+    records of the root 'items' array on 'id', and
+    'orders[*].lines[*].sku' the lines of every order on 'sku'.
+    :param keys: key specs.
+    :return: (array path pattern, member) of every spec.
+    :rtype: list
+    """
+    parsed = []
+    for spec in keys or ():
+        head, sep, member = spec.rpartition('[*].')
+        if not sep or not member:
+            raise ValueError("Invalid json key '{}', expected "
+                             "'<array path>[*].<member>'".format(spec))
+        pattern = []
+        for part in head.split('.') if head else ():
+            name = part.replace('[*]', '')
+            if name:
+                pattern.append(name)
+            pattern.extend(['*'] * part.count('[*]'))
+        parsed.append((tuple(pattern), member))
+    return parsed
+
+
+def _array_key(keys, path):
+    """Return the identity member of the array at path, or None."""
+    for pattern, member in keys or ():
+        if len(pattern) == len(path) and all(
+                name in ('*', part) for name, part in zip(pattern, path)):
+            return member
+    return None
+
+
+def _record_key(record, member, path):
+    """Return the identity key of a keyed array record."""
+    try:
+        return record[member]
+    except (KeyError, TypeError):
+        raise ValueError("Record of {} has no key '{}'".format(
+            pointer(path) or '/', member))
+
+
+def _index_records(records, member, path):
+    """Return the hash index, key to record, of keyed array records."""
+    index = {}
+    for record in records:
+        key = _record_key(record, member, path)
+        if key in index:
+            raise ValueError("Duplicate key {} in {}".format(
+                key, pointer(path) or '/'))
+        index[key] = record
+    return index
+
+
+def record_segment(member, key):
+    """Return the path segment of a keyed array record.
+
+    The segment, e.g. '[id=3]' or '[sku="a1"]', holds the member and the
+    json form of its key, so it is not mistaken for an array index.
+    :param member: identity member of the array records.
+    :param key: identity key of the record.
+    :rtype: str
+    """
+    return '[{}={}]'.format(member, json.dumps(key, sort_keys=True))
+
+
+def _diff_records(index, records, member, path, keys):
+    """Yield the patches of keyed array records against a source index.
+
+    :param index: source records from _index_records, emptied.
+    :param records: iterable of target records.
+    """
+    for record in records:
+        key = _record_key(record, member, path)
+        segment = record_segment(member, key)
+        if key not in index:
+            yield _patch('add', path + (segment,), new=record)
+            continue
+        for patch in diff_values(index.pop(key), record, path + (segment,),
+                                 keys):
+            yield patch
+    for key, record in index.items():
+        yield _patch('remove', path + (record_segment(member, key),),
+                     old=record)
+
+
+def _patch(op, path, old=None, new=None):
+    """Return a path addressed patch.
+
+    'remove' and 'replace' carry the 'old' value, 'add' and 'replace'
+    the new 'value'.
+    """
+    patch = {'op': op, 'path': pointer(path)}
+    if op != 'add':
+        patch['old'] = old
+    if op != 'remove':
+        patch['value'] = new
+    return patch
+
+
+def diff_values(old, new, path=(), keys=None):
+    """Yield the patches turning one json value into another.
+
+    Objects are diffed by key and arrays by position, except keyed arrays
+    whose records are matched on their identity key through a hash
+    index, patch paths addressing a record by a record_segment, e.g.
+    '/items/[id=3]', instead of its position. Such paths are not RFC 6901
+    pointers into the array.
+    :param old: source value.
+    :param new: target value.
+    :param path: path of the values.
+    :param keys: parse_keys identity keys of arrays.
+    :rtype: generator
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                yield _patch('remove', path + (key,), old=old[key])
+            else:
+                for patch in diff_values(old[key], new[key], path + (key,),
+                                         keys):
+                    yield patch
+        for key in new:
+            if key not in old:
+                yield _patch('add', path + (key,), new=new[key])
+    elif isinstance(old, list) and isinstance(new, list):
+        member = _array_key(keys, path)
+        if member is not None:
+            for patch in _diff_records(_index_records(old, member, path),
+                                       new, member, path, keys):
+                yield patch
+            return
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            for patch in diff_values(old_item, new_item, path + (index,),
+                                     keys):
+                yield patch
+        for index in range(len(new), len(old)):
+            yield _patch('remove', path + (index,), old=old[index])
+        for index in range(len(old), len(new)):
+            yield _patch('add', path + (index,), new=new[index])
+    elif old != new or isinstance(old, bool) != isinstance(new, bool):
+        yield _patch('replace', path, old=old, new=new)
+
+
+class _Events(object):
+    """Parser events of a json document."""
+
+    def __init__(self, handle):
+        """Parse the json document of an open binary file."""
+        events = ijson.basic_parse(handle, use_float=True)
+        # The bound method of the parser, next is the hot path.
+        self.next = getattr(events, '__next__', None) or events.next
+
+    def build(self, event, value):
+        """Return the json value starting with (event, value).
+
+        :param event: first event of the value, already consumed.
+        :param value: value of the first event.
+        """
+        if event in SCALAR_EVENTS:
+            return value
+        root = {} if event == 'start_map' else []
+        stack = [root]
+        key = None
+        while stack:
+            event, value = self.next()
+            if event == 'map_key':
+                key = value
+                continue
+            if event in ('end_map', 'end_array'):
+                stack.pop()
+                continue
+            if event == 'start_map':
+                value = {}
+            elif event == 'start_array':
+                value = []
+            # Containers are added when they start, while key is theirs.
+            container = stack[-1]
+            if isinstance(container, dict):
+                container[key] = value
+            else:
+                container.append(value)
+            if event in ('start_map', 'start_array'):
+                stack.append(value)
+        return root
+
+    def build_next(self):
+        """Consume and return the next json value."""
+        return self.build(*self.next())
+
+    def iter_array(self):
+        """Consume and yield the remaining items of an array."""
+        event, value = self.next()
+        while event != 'end_array':
+            yield self.build(event, value)
+            event, value = self.next()
+
+    def rest_of_map(self, event, value):
+        """Consume and return the remaining members of an object.
+
+        :param event: 'map_key' or 'end_map', already consumed.
+        :param value: value of the event.
+        :return: key to (subtree hash, value).
+        :rtype: dict
+        """
+        members = {}
+        while event == 'map_key':
+            member = self.build_next()
+            members[value] = (subtree_hash(member), member)
+            event, value = self.next()
+        return members
+
+
+def _diff_maps(source, target, path, keys):
+    """Diff two objects whose 'start_map' was consumed.
+
+    Members are compared in lockstep while both objects list the same
+    keys in the same order, so memory only grows with the nesting depth.
+    From the first diverging key the remaining source members are kept
+    with their subtree hash and the target members are matched one at a
+    time, identical subtrees being skipped on their hashes.
+    """
+    while True:
+        source_event, source_key = source.next()
+        target_event, target_key = target.next()
+        if source_event == target_event == 'end_map':
+            return
+        if source_event == target_event and source_key == target_key:
+            source_item = source.next()
+            target_item = target.next()
+            # Equal scalars, the common case, skip the _diff_events call.
+            if source_item == target_item and \
+                    source_item[0] in SCALAR_EVENTS:
+                continue
+            for patch in _diff_events(source, target, source_item,
+                                      target_item, path + (source_key,),
+                                      keys):
+                yield patch
+            continue
+        remaining = source.rest_of_map(source_event, source_key)
+        while target_event == 'map_key':
+            member = target.build_next()
+            old = remaining.pop(target_key, None)
+            if old is None:
+                yield _patch('add', path + (target_key,), new=member)
+            elif old[0] != subtree_hash(member):
+                for patch in diff_values(old[1], member,
+                                         path + (target_key,), keys):
+                    yield patch
+            target_event, target_key = target.next()
+        for key, (_, member) in remaining.items():
+            yield _patch('remove', path + (key,), old=member)
+        return
+
+
+def _diff_arrays(source, target, path, keys):
+    """Diff two arrays whose 'start_array' was consumed, by position.
+
+    Keyed arrays index the source records and match the target records
+    one at a time instead.
+    """
+    member = _array_key(keys, path)
+    if member is not None:
+        index = _index_records(source.iter_array(), member, path)
+        for patch in _diff_records(index, target.iter_array(), member, path,
+                                   keys):
+            yield patch
+        return
+    index = 0
+    while True:
+        source_item = source.next()
+        target_item = target.next()
+        if 'end_array' in (source_item[0], target_item[0]):
+            break
+        if source_item == target_item and source_item[0] in SCALAR_EVENTS:
+            index += 1
+            continue
+        for patch in _diff_events(source, target, source_item, target_item,
+                                  path + (index,), keys):
+            yield patch
+        index += 1
+    while source_item[0] != 'end_array':
+        yield _patch('remove', path + (index,), old=source.build(*source_item))
+        source_item = source.next()
+        index += 1
+    while target_item[0] != 'end_array':
+        yield _patch('add', path + (index,), new=target.build(*target_item))
+        target_item = target.next()
+        index += 1
+
+
+def _diff_events(source, target, source_item, target_item, path, keys):
+    """Diff the json values of two event streams.
+
+    Scalars are compared right away, without a generator per value.
+    :param source_item: first (event, value) of the source value.
+    :param target_item: first (event, value) of the target value.
+    :return: patches.
+    :rtype: iterable
+    """
+    source_event, source_value = source_item
+    target_event, target_value = target_item
+    if source_event in SCALAR_EVENTS and target_event in SCALAR_EVENTS:
+        if source_item != target_item:
+            return [_patch('replace', path, old=source_value,
+                           new=target_value)]
+        return ()
+    if source_event == target_event == 'start_map':
+        return _diff_maps(source, target, path, keys)
+    if source_event == target_event == 'start_array':
+        return _diff_arrays(source, target, path, keys)
+    return [_patch('replace', path,
+                   old=source.build(source_event, source_value),
+                   new=target.build(target_event, target_value))]
+
+
+def stream_diff(source, target, keys=None):
+    """Yield the patches turning one json document into another.
+
+    Both documents are parsed incrementally and walked in lockstep, so
+    identical branches are skipped without being built and memory grows
+    with the nesting depth, not the document size. Only changed values
+    and the members following a diverging object key are built.
+    Patches are dictionaries of 'op'('add', 'remove' or 'replace'), json
+    pointer 'path', 'old' and new 'value'. Array patches are positional:
+    'remove' paths index the source array and 'add' paths the target.
+    Keyed arrays are diffed by record instead, holding the source array
+    records while the target records are streamed, and their patch paths
+    address records by record_segment, e.g. '/items/[id=3]'.
+    :param source: source json file path or binary file object.
+    :param target: target json file path or binary file object.
+    :param keys: identity keys of arrays, see parse_keys.
+    :rtype: generator
+    """
+    if ijson is None:
+        raise ImportError("Streaming json comparison requires ijson")
+    handles = [open(document, 'rb') if not hasattr(document, 'read')
+               else document for document in (source, target)]
+    try:
+        source_events, target_events = _Events(handles[0]), _Events(handles[1])
+        for patch in _diff_events(source_events, target_events,
+                                  source_events.next(), target_events.next(),
+                                  (), parse_keys(keys)):
+            yield patch
+    finally:
+        for document, handle in zip((source, target), handles):
+            if handle is not document:
+                handle.close()
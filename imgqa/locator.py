@@ -0,0 +1,119 @@
+"""Precompiled locators of BrowserActions keywords."""
+from selenium.webdriver.common.by import By
+
+STRATEGIES = dict(
+    (name, getattr(By, name))
+    for name in ('ID', 'NAME', 'CLASS_NAME', 'CSS_SELECTOR', 'LINK_TEXT',
+                 'PARTIAL_LINK_TEXT', 'XPATH', 'TAG_NAME'))
+STRATEGIES.update((by, by) for by in list(STRATEGIES.values()))
+
+_DICT_LOCATORS = {}  # (by, locate value, text) of dict locators to Locator
+
+
+def strategy(by):
+    """Return the selenium By strategy named by.
+
+    :param by: 'By.ID', 'id', 'CLASS_NAME', By.CSS_SELECTOR...
+    :rtype: str
+    """
+    name = by.strip()
+    if name.upper().startswith('BY.'):
+        name = name[3:]
+    try:
+        return STRATEGIES.get(name) or STRATEGIES[
+            name.upper().replace(' ', '_')]
+    except KeyError:
+        raise AssertionError("unknown locator strategy %s" % by)
+
+
+class Locator(object):
+    """Immutable, hashable locator with its By strategy resolved once.
+
+    Usage: Locator('By.ID', 'search-courses', text='selenium'), text being
+    the keys send_keys types or the value a keyword selects.
+    """
+
+    __slots__ = ('by', 'value', 'text')
+
+    def __init__(self, by, value, text=None):
+        """Resolve the strategy of a locator.
+
+        :param by: strategy name, see strategy.
+        :param value: locator value.
+        :param text: (optional) text of send_keys.
+        """
+        object.__setattr__(self, 'by', strategy(by))
+        object.__setattr__(self, 'value', value)
+        object.__setattr__(self, 'text', text)
+
+    @classmethod
+    def from_dict(cls, locator_dict, value_key='locatorvalue'):
+        """Return the Locator of a locator dictionary.
+
+        :param locator_dict: {'by': 'By.ID', 'locatorvalue': 'id of the
+            element', 'value': 'text to send'}.
+        :param value_key: key of the locator value.
+        :rtype: Locator
+        """
+        try:
+            key = (locator_dict['by'], locator_dict[value_key],
+                   locator_dict.get('value'))
+        except KeyError as exc:
+            raise AssertionError("Locator dictionary has no key %s" % exc)
+        try:
+            return _DICT_LOCATORS[key]
+        except KeyError:
+            locator = _DICT_LOCATORS[key] = cls(*key)
+            return locator
+        except TypeError:
+            # Unhashable values are not memoized.
+            return cls(*key)
+
+    def __setattr__(self, name, value):
+        """Refuse changes, locators are immutable."""
+        raise AttributeError("Locator is immutable")
+
+    def __delattr__(self, name):
+        """Refuse changes, locators are immutable."""
+        raise AttributeError("Locator is immutable")
+
+    def __eq__(self, other):
+        """Compare strategy, value and text."""
+        return isinstance(other, Locator) and (
+            self.by, self.value, self.text) == (
+            other.by, other.value, other.text)
+
+    def __ne__(self, other):
+        """Compare strategy, value and text."""
+        return not self == other
+
+    def __hash__(self):
+        """Hash strategy, value and text."""
+        return hash((self.by, self.value, self.text))
+
+    def __reduce__(self):
+        """Pickle the locator through its constructor."""
+        return Locator, (self.by, self.value, self.text)
+
+    def __repr__(self):
+        """Return the constructor call of the locator."""
+        return 'Locator({!r}, {!r}, text={!r})'.format(
+            self.by, self.value, self.text)
+
+    def __str__(self):
+        """Return 'by=value' for messages."""
+        return '{}={}'.format(self.by, self.value)
+
+
+def as_locator(locator, value_key='locatorvalue'):
+    """Return a Locator of a Locator or locator dictionary.
+
+    :param locator: Locator or locator dictionary.
+    :param value_key: key of the locator value of dictionaries.
+    :rtype: Locator
+    """
+    if isinstance(locator, Locator):
+        return locator
+    if isinstance(locator, dict):
+        return Locator.from_dict(locator, value_key)
+    raise AssertionError("Locator type should be Locator or dictionary.")
@@ -0,0 +1,386 @@
+"""Run BrowserActions test suites in parallel worker processes.
+
+Usage: python -m imgqa.parallel [-n WORKERS] [--headless]
+[--profile PROFILE] [--screenshot-dir DIR] test names(modules, classes or
+methods).
+"""
+import argparse
+import collections
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import time
+import unittest
+from multiprocessing import util
+
+from imgqa.browseractions import BrowserActions
+from imgqa.driverpool import (MAX_USES, PROFILE_ENV, PROFILES, DriverPool,
+                              chrome)
+
+RESULT_KEYS = ('test', 'outcome', 'message', 'elapsed', 'screenshot',
+               'worker')
+
+
+class _WorkerPool(DriverPool):
+    """Single session pool of a worker holding released sessions back.
+
+    The worker screenshots a failed test before the session is reset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create the pool."""
+        super(_WorkerPool, self).__init__(*args, **kwargs)
+        self.released = []
+
+    def release(self, driver):
+        """Hold a released session until settle."""
+        self.released.append(driver)
+
+    def settle(self):
+        """Release the held sessions."""
+        while self.released:
+            super(_WorkerPool, self).release(self.released.pop())
+
+
+def _init_worker(headless, max_uses, profile=None):
+    """Give the worker process its own browser sessions.
+
+    Suites setting browser_profile get a worker pool of that profile,
+    made on first use.
+    """
+    BrowserActions.driver_pool = _worker_pool(headless, max_uses, profile)
+    # Pools of the parent process are not the worker's to use.
+    BrowserActions.profile_pools = {}
+    BrowserActions.profile_pool_factory = functools.partial(
+        _worker_pool, headless, max_uses)
+
+
+def _worker_pool(headless, max_uses, profile=None):
+    """Return a single session pool quitting its browser at worker exit."""
+    pool = _WorkerPool(size=1, max_uses=max_uses,
+                       factory=functools.partial(chrome, headless, profile))
+    util.Finalize(pool, pool.close, exitpriority=10)
+    return pool
+
+
+def _worker_pools():
+    """Return the pools of the worker, the shared one first."""
+    return [BrowserActions.driver_pool] + [
+        BrowserActions.profile_pools[name]
+        for name in sorted(BrowserActions.profile_pools)]
+
+
+def _settle():
+    """Release the sessions held by the pools of the worker."""
+    for pool in _worker_pools():
+        pool.settle()
+
+
+def _screenshot(pools, screenshot_dir, name):
+    """Save the screen of the session a failed test held, or None."""
+    released = [driver for pool in pools for driver in pool.released]
+    if not screenshot_dir or not released:
+        return None
+    path = os.path.join(screenshot_dir, name + '.png')
+    try:
+        if released[-1].get_screenshot_as_file(path):
+            return path
+    except Exception as exc:
+        logging.warning("No screenshot of %s: %s", name, exc)
+    return None
+
+
+class _RowResult(unittest.TestResult):
+    """TestResult making a result row of every test run.
+
+    The screen of a failed test is saved when the test stops, before its
+    browser session is reset. Errors of class and module fixtures, raised
+    outside of any test, are kept in fixture_errors.
+    """
+
+    def __init__(self, screenshot_dir, names):
+        """Create the result.
+
+        :param screenshot_dir: directory of failed test screenshots.
+        :param names: test name by id of the loaded test.
+        """
+        super(_RowResult, self).__init__()
+        self.screenshot_dir = screenshot_dir
+        self.names = names
+        self.rows = []
+        self.row = None
+        self.start = None
+        self.fixture_errors = []
+        self.fixture_skips = []
+
+    def startTest(self, test):
+        """Start the row of a test."""
+        super(_RowResult, self).startTest(test)
+        self.row = _row(self.names.get(id(test), test.id()))
+        self.start = time.time()
+
+    def stopTest(self, test):
+        """Finish the row of a test and reset its browser session."""
+        super(_RowResult, self).stopTest(test)
+        row, self.row = self.row, None
+        row['elapsed'] = time.time() - self.start
+        if row['outcome'] in ('failed', 'error'):
+            row['screenshot'] = _screenshot(
+                _worker_pools(), self.screenshot_dir, row['test'])
+        _settle()
+        self.rows.append(row)
+
+    def addError(self, test, err):
+        """Record an error of a test or a fixture."""
+        super(_RowResult, self).addError(test, err)
+        self.__fail('error', self.errors[-1][1])
+
+    def addFailure(self, test, err):
+        """Record a failure of a test."""
+        super(_RowResult, self).addFailure(test, err)
+        self.__fail('failed', self.failures[-1][1])
+
+    def addUnexpectedSuccess(self, test):
+        """Record an expected failure that passed."""
+        super(_RowResult, self).addUnexpectedSuccess(test)
+        self.__fail('failed', 'unexpected success')
+
+    def addSubTest(self, test, subtest, err):
+        """Record a failed or erroring subTest of a test."""
+        super(_RowResult, self).addSubTest(test, subtest, err)
+        if err is not None:
+            if issubclass(err[0], test.failureException):
+                self.__fail('failed', self.failures[-1][1])
+            else:
+                self.__fail('error', self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        """Record a skipped test or fixture."""
+        super(_RowResult, self).addSkip(test, reason)
+        if self.row is None:
+            self.fixture_skips.append(reason)
+        elif self.row['outcome'] == 'passed':
+            self.row.update(outcome='skipped', message=reason)
+
+    def __fail(self, outcome, message):
+        """Mark the current row failed, or keep a fixture error."""
+        if self.row is None:
+            self.fixture_errors.append(message)
+            return
+        if self.row['outcome'] != 'error':
+            self.row['outcome'] = outcome
+        if self.row['outcome'] == 'skipped' or not self.row['message']:
+            self.row['message'] = message
+        else:
+            self.row['message'] += '\n' + message
+
+
+def _row(name, **values):
+    """Return a result row of a test, passed unless values say otherwise."""
+    row = dict((key, None) for key in RESULT_KEYS)
+    row.update(test=name, outcome='passed', worker=os.getpid())
+    row.update(values)
+    return row
+
+
+def _run_test(job):
+    """Run a job of tests in a worker and return their result rows.
+
+    The tests, one method or the methods of a class, run as one suite, so
+    setUpClass and tearDownClass run once.
+    Tests not run because a class or module fixture failed or was skipped
+    get an 'error' or 'skipped' row with its message, and a fixture error
+    raised after the tests, e.g. by tearDownClass, fails the last test.
+    :param job: tuple of (test method names, of a single class, screenshot
+        directory).
+    :return: result rows, in the order of the tests.
+    :rtype: list
+    """
+    names, screenshot_dir = job
+    loaded = {}
+    suite = unittest.TestSuite()
+    try:
+        for name in names:
+            tests = unittest.defaultTestLoader.loadTestsFromName(name)
+            for test in _flatten(tests):
+                loaded[id(test)] = name
+                suite.addTest(test)
+    except Exception as exc:
+        message = '{}: {}'.format(type(exc).__name__, exc)
+        return [_row(name, outcome='error', message=message, elapsed=0.0)
+                for name in names]
+    result = _RowResult(screenshot_dir, loaded)
+    try:
+        suite.run(result)
+    except Exception as exc:
+        result.fixture_errors.append('{}: {}'.format(
+            type(exc).__name__, exc))
+    _settle()
+    rows = result.rows
+    ran = set(row['test'] for row in rows)
+    if result.fixture_errors:
+        message = '\n'.join(str(error) for error in result.fixture_errors)
+        missing = [name for name in names if name not in ran]
+        if missing:
+            rows.extend(_row(name, outcome='error', message=message,
+                             elapsed=0.0) for name in missing)
+        else:
+            rows[-1]['outcome'] = 'error'
+            rows[-1]['message'] = '\n'.join(
+                filter(None, (rows[-1]['message'], message)))
+    elif result.fixture_skips:
+        rows.extend(_row(name, outcome='skipped',
+                         message=result.fixture_skips[0], elapsed=0.0)
+                    for name in names if name not in ran)
+    return rows
+
+
+def _flatten(tests):
+    """Return the test cases of a test or suite."""
+    if isinstance(tests, unittest.TestSuite):
+        return [case for test in tests for case in _flatten(test)]
+    return [tests]
+
+
+def _has_class_fixtures(name):
+    """Return whether the class of a test method has class fixtures.
+
+    :param name: test method name.
+    :rtype: bool
+    """
+    tests = _flatten(unittest.defaultTestLoader.loadTestsFromName(name))
+    test_class = type(tests[0]) if tests else None
+    return test_class is not None and any(
+        getattr(getattr(test_class, fixture), '__func__', None) is not
+        getattr(unittest.TestCase, fixture).__func__
+        for fixture in ('setUpClass', 'tearDownClass'))
+
+
+def _jobs(names, screenshot_dir):
+    """Split test method names into worker jobs, in the order of the tests.
+
+    The methods of a class with setUpClass or tearDownClass make one job,
+    so the fixtures run once; other methods make a job each.
+    :return: (test method names, screenshot directory) jobs.
+    :rtype: list
+    """
+    classes = collections.OrderedDict()
+    for name in names:
+        classes.setdefault(name.rsplit('.', 1)[0], []).append(name)
+    jobs = []
+    for methods in classes.values():
+        if _has_class_fixtures(methods[0]):
+            jobs.append((methods, screenshot_dir))
+        else:
+            jobs.extend(([method], screenshot_dir) for method in methods)
+    return jobs
+
+
+def collect_test_names(tests):
+    """Return the names of the test methods of tests.
+
+    :param tests: TestSuite, TestCase or test names(module, class or
+        method).
+    :rtype: list
+    """
+    if isinstance(tests, unittest.TestSuite):
+        return [name for test in tests for name in collect_test_names(test)]
+    if isinstance(tests, unittest.TestCase):
+        return [tests.id()]
+    return collect_test_names(
+        unittest.defaultTestLoader.loadTestsFromNames(tests))
+
+
+def iter_parallel(tests, workers=None, headless=False, screenshot_dir=None,
+                  max_uses=MAX_USES, profile=None):
+    """Run test methods in worker processes and yield each result.
+
+    Test methods are handed to the workers one at a time so the load
+    stays balanced, except the methods of a class defining setUpClass or
+    tearDownClass, handed together to one worker so the fixtures run
+    once. Results are yielded as soon as a job finishes. setUpModule and
+    tearDownModule run around every job of their module. Every worker
+    leases one browser session of its own, reused by its tests, and one
+    of every browser_profile its suites set. Test modules must be
+    importable by name in the workers.
+    :param tests: TestSuite, TestCase or test names(module, class or
+        method).
+    :param workers: number of worker processes, defaults to cpu count.
+    :param headless: run the browsers without a window.
+    :param screenshot_dir: directory receiving <test name>.png screenshots
+        of failed tests.
+    :param max_uses: tests run by a browser session before it is
+        recycled.
+    :param profile: driverpool.PROFILES name of the browsers, see
+        driverpool.browser_profile.
+    :return: generator of result rows with test, outcome('passed',
+        'failed', 'error' or 'skipped'), message, elapsed, screenshot and
+        worker(process id) keys.
+    :rtype: generator
+    """
+    names = collect_test_names(tests)
+    if screenshot_dir and not os.path.exists(screenshot_dir):
+        os.makedirs(screenshot_dir)
+    pool = multiprocessing.Pool(
+        workers, _init_worker, (headless, max_uses, profile))
+    try:
+        for rows in pool.imap_unordered(
+                _run_test, _jobs(names, screenshot_dir)):
+            for row in rows:
+                yield row
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def run_parallel(tests, workers=None, headless=False, screenshot_dir=None,
+                 max_uses=MAX_USES, profile=None):
+    """Run test methods in worker processes, see iter_parallel.
+
+    :return: result rows in the order of the tests.
+    :rtype: list
+    """
+    names = collect_test_names(tests)
+    order = dict((name, index) for index, name in enumerate(names))
+    rows = list(iter_parallel(names, workers, headless, screenshot_dir,
+                              max_uses, profile))
+    return sorted(rows, key=lambda row: order[row['test']])
+
+
+def main(argv=None):
+    """Run the named tests in parallel and print a summary."""
+    parser = argparse.ArgumentParser(
+        description="Run BrowserActions tests in parallel workers.")
+    parser.add_argument('tests', nargs='+',
+                        help="test modules, classes or methods")
+    parser.add_argument('-n', '--workers', type=int, default=None,
+                        help="worker processes, defaults to cpu count")
+    parser.add_argument('--headless', action='store_true',
+                        help="run the browsers without a window")
+    parser.add_argument('--profile', default=None, choices=sorted(PROFILES),
+                        help="browser profile, defaults to ${}".format(
+                            PROFILE_ENV))
+    parser.add_argument('--screenshot-dir', default=None,
+                        help="directory of failed test screenshots")
+    args = parser.parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    start = time.time()
+    failed = 0
+    for row in iter_parallel(args.tests, args.workers, args.headless,
+                             args.screenshot_dir, profile=args.profile):
+        failed += row['outcome'] in ('failed', 'error')
+        print("{outcome:7} {test} ({elapsed:.2f}s)".format(**row))
+        if row['message']:
+            print(row['message'])
+    print("Ran tests in {:.2f}s, {} failed".format(time.time() - start,
+                                                   failed))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""In-memory screenshots and their background writer."""
+import logging
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+WRITER_QUEUE_SIZE = 16  # screenshots waiting to be written
+
+# Leading bytes of the encoded images decode accepts.
+ENCODED_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff')
+
+
+def is_encoded(image):
+    """Return whether image is encoded PNG or JPEG bytes, not a path."""
+    return isinstance(image, (bytes, bytearray)) and any(
+        bytes(image[:len(signature)]) == signature
+        for signature in ENCODED_SIGNATURES)
+
+
+def decode(data):
+    """Decode PNG or JPEG bytes.
+
+    :param data: encoded image bytes.
+    :return: decoded BGR image, as cv2.imread returns.
+    :rtype: numpy.ndarray
+    """
+    image = cv2.imdecode(np.frombuffer(bytes(data), np.uint8),
+                         cv2.IMREAD_COLOR)
+    if image is None:
+        raise IOError("Unable to decode image bytes")
+    return image
+
+
+def encode_png(image, compression=None):
+    """Encode a decoded image or re-encode PNG bytes.
+
+    :param image: decoded image or encoded bytes.
+    :param compression: (optional) PNG compression level, 0-9.
+    :return: PNG bytes.
+    :rtype: bytes
+    """
+    if is_encoded(image):
+        if compression is None:
+            return bytes(image)
+        image = decode(image)
+    params = [] if compression is None else [
+        cv2.IMWRITE_PNG_COMPRESSION, compression]
+    encoded, data = cv2.imencode('.png', image, params)
+    if not encoded:
+        raise IOError("Unable to encode image")
+    return data.tobytes()
+
+
+def crop(image, rect, scale=1.0):
+    """Return a region of a decoded image.
+
+    :param image: decoded image.
+    :param rect: (x, y, width, height) of the region in CSS pixels.
+    :param scale: image pixels per CSS pixel(the device pixel ratio).
+    :rtype: numpy.ndarray
+    """
+    x, y, width, height = [int(round(value * scale)) for value in rect]
+    region = image[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)]
+    if not region.size:
+        raise ValueError("Region {} is outside of the image".format(rect))
+    return region
+
+
+def stitch(tiles, height):
+    """Paste screenshots of a scrolled page into one image.
+
+    :param tiles: (top row, decoded image) of every screenshot, later
+        tiles overwriting the rows they share with earlier ones.
+    :param height: rows of the stitched image.
+    :rtype: numpy.ndarray
+    """
+    first = tiles[0][1]
+    canvas = np.zeros((height,) + first.shape[1:], first.dtype)
+    for top, tile in tiles:
+        rows = max(min(tile.shape[0], height - top), 0)
+        canvas[top:top + rows] = tile[:rows, :canvas.shape[1]]
+    return canvas
+
+
+class ScreenshotWriter(object):
+    """Write screenshots to disk from a background thread.
+
+    Tests queue the captured bytes and go on; the queue is bounded so a
+    test capturing faster than the disk writes waits instead of holding
+    every screenshot in memory. Files are replaced atomically, and write
+    errors are raised by the next flush.
+    """
+
+    def __init__(self, queue_size=WRITER_QUEUE_SIZE, compression=None):
+        """Start the writer thread.
+
+        :param queue_size: screenshots queued before write blocks.
+        :param compression: (optional) PNG compression level, 0-9, the
+            screenshots are re-encoded with in the writer thread.
+        """
+        self.compression = compression
+        self.queue = queue.Queue(queue_size)
+        self.errors = []
+        self.thread = threading.Thread(target=self.__run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, path, image):
+        """Queue a screenshot to be written.
+
+        :param path: file path, its directory is created if missing.
+        :param image: PNG bytes or decoded image.
+        :return: path.
+        """
+        if self.thread is None:
+            raise IOError("Screenshot writer is closed")
+        self.queue.put((path, image))
+        return path
+
+    def flush(self):
+        """Wait for the queued screenshots to be written."""
+        self.queue.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            raise IOError("Failed to write screenshots: {}".format(
+                '; '.join(errors)))
+
+    def close(self):
+        """Write the queued screenshots and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.flush()
+
+    def __run(self):
+        """Write queued screenshots until close."""
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self.__write(*job)
+            except Exception as exc:
+                logging.error("Failed to write screenshot %s: %s",
+                              job[0], exc)
+                self.errors.append('{}: {}'.format(job[0], exc))
+            finally:
+                self.queue.task_done()
+
+    def __write(self, path, image):
+        """Encode and write a screenshot atomically."""
+        data = encode_png(image, self.compression)
+        directory = os.path.dirname(path) or '.'
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                temp_file.write(data)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
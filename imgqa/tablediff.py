@@ -0,0 +1,740 @@
+# -*- coding: utf-8 -*-
+"""Table diff engines behind Compare.compare_files."""
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+HASH_PARTITIONS = 16
+
+CHUNK_SIZE = 100000  # rows
+
+SEPARATORS = {'csv': ',', 'tsv': '\t'}
+
+SNAPSHOT_EXTN = 'arrow'
+
+HASH_COLUMN = '__row_hash__'
+
+_HASH_COLUMNS_KEY = b'imgqa.hash_columns'
+
+_HASHED_KEY = b'imgqa.hashed'  # 'file' text or parsed 'values'
+
+_HASH_ROW = np.dtype([('hash', '<u8'), ('row', '<i8')])
+
+
+def row_hashes(frame, columns=None):
+    """Return the 64 bit hash of every row of a data frame.
+
+    :param frame: data frame.
+    :param columns: (optional) columns hashed, defaults to all.
+    :return: hashes in row order.
+    :rtype: numpy.ndarray
+    """
+    if columns:
+        frame = frame[list(columns)]
+    return pd.util.hash_pandas_object(frame, index=False).values
+
+
+def read_chunks(path, sep=',', chunksize=CHUNK_SIZE):
+    """Read a delimited file chunk by chunk as text.
+
+    Every value is read as a string so a row hashes the same whatever
+    dtype pandas would have inferred for the chunk it falls in.
+    :param path: csv or tsv file path.
+    :param sep: field separator.
+    :param chunksize: rows per chunk.
+    :return: data frame chunks, indexed by row number in the file.
+    :rtype: generator
+    """
+    return pd.read_csv(path, sep=sep, chunksize=chunksize, dtype=str,
+                       keep_default_na=False)
+
+
+def file_hashes(path, sep=',', columns=None, chunksize=CHUNK_SIZE):
+    """Return the row hashes of a delimited file, as stream_diff hashes it.
+
+    :param path: csv or tsv file path.
+    :param sep: field separator.
+    :param columns: (optional) columns hashed, defaults to all.
+    :param chunksize: rows read at once.
+    :return: hashes in row order.
+    :rtype: numpy.ndarray
+    """
+    hashes = [row_hashes(chunk, columns)
+              for chunk in read_chunks(path, sep, chunksize)]
+    return np.concatenate(hashes) if hashes else np.empty(0, np.uint64)
+
+
+def text_hashes(frame, columns=None):
+    """Return row hashes of a data frame by the text form of its values.
+
+    Missing values hash as empty text, like read_chunks reads them.
+    :param frame: data frame.
+    :param columns: (optional) columns hashed, defaults to all.
+    :return: hashes in row order.
+    :rtype: numpy.ndarray
+    """
+    if columns:
+        frame = frame[list(columns)]
+    text = frame.astype(object).where(frame.notnull(), '').astype(str)
+    return row_hashes(text)
+
+
+def is_snapshot(path):
+    """Return True for baseline snapshot paths."""
+    return path.rsplit('.', 1)[-1].lower() == SNAPSHOT_EXTN
+
+
+def write_snapshot(frame, hashes, path, hash_columns=None, hashed='file'):
+    """Write a data frame and its row hashes as a baseline snapshot.
+
+    Snapshots are uncompressed Arrow IPC files, so they are memory mapped
+    back without parsing or copying.
+    :param frame: data frame.
+    :param hashes: row hashes of frame.
+    :param path: snapshot path.
+    :param hash_columns: (optional) columns the hashes were computed on.
+    :param hashed: 'file' for hashes of the csv/tsv text, as file_hashes
+        computes them, 'values' for text_hashes of parsed values.
+    """
+    if pa is None:
+        raise ImportError("Baseline snapshots require pyarrow")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    table = table.append_column(
+        HASH_COLUMN, pa.array(np.asarray(hashes), type=pa.uint64()))
+    metadata = dict(table.schema.metadata or {})
+    metadata[_HASH_COLUMNS_KEY] = json.dumps(list(hash_columns or []))
+    metadata[_HASHED_KEY] = hashed
+    table = table.replace_schema_metadata(metadata)
+    with pa.OSFile(path, 'wb') as sink:
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+
+
+def open_snapshot(path):
+    """Memory map a baseline snapshot.
+
+    :param path: snapshot path.
+    :return: snapshot table, hash column included.
+    :rtype: pyarrow.Table
+    """
+    if pa is None:
+        raise ImportError("Baseline snapshots require pyarrow")
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def _data_table(table):
+    """Return a snapshot table without its hash column."""
+    return table.remove_column(table.schema.get_field_index(HASH_COLUMN))
+
+
+def read_snapshot(path):
+    """Return the data frame of a baseline snapshot.
+
+    :param path: snapshot path.
+    :rtype: data frame.
+    """
+    return _data_table(open_snapshot(path)).to_pandas()
+
+
+def snapshot_hashes(path, columns=None):
+    """Return the precomputed row hashes of a baseline snapshot.
+
+    :param path: snapshot path.
+    :param columns: (optional) columns the hashes must be computed on.
+    :return: hashes in row order, memory mapped.
+    :rtype: numpy.ndarray
+    """
+    table = open_snapshot(path)
+    hashed = json.loads(
+        table.schema.metadata[_HASH_COLUMNS_KEY].decode('utf-8'))
+    if list(columns or []) != hashed:
+        raise ValueError(
+            "Snapshot '{}' rows are hashed on columns {}, not {}".format(
+                path, hashed or 'all', list(columns or []) or 'all'))
+    return table.column(HASH_COLUMN).to_numpy()
+
+
+def hashed_from(path):
+    """Return what the row hashes of a chunked diff side are computed on.
+
+    :param path: csv, tsv or snapshot path.
+    :return: 'file' for csv/tsv text, 'values' for parsed values or None
+        for snapshots not recording it.
+    :rtype: str
+    """
+    if not is_snapshot(path):
+        return 'file'
+    hashed = open_snapshot(path).schema.metadata.get(_HASHED_KEY)
+    return hashed.decode('utf-8') if hashed else None
+
+
+class HashPartitions(object):
+    """(row hash, row number) pairs partitioned by hash.
+
+    Pairs are buffered in memory and spilled to one file per partition
+    once more than max_buffered pairs are held. A partition holding more
+    pairs than wanted in memory is split into partitions of the next
+    level, on the next digits of the hashes, read back max_buffered pairs
+    at a time.
+    """
+
+    def __init__(self, spill_dir, name, partitions=HASH_PARTITIONS,
+                 max_buffered=CHUNK_SIZE, level=0):
+        """Partition pairs into spill_dir/name.<partition>.
+
+        :param spill_dir: directory of the spill files.
+        :param name: spill file prefix.
+        :param partitions: number of partitions.
+        :param max_buffered: pairs held in memory before spilling.
+        :param level: partitions ** level divides the hashes before they
+            are partitioned.
+        """
+        self.spill_dir = spill_dir
+        self.name = name
+        self.partitions = partitions
+        self.max_buffered = max_buffered
+        self.level = level
+        self.divisor = np.uint64(partitions ** level)
+        self.paths = [os.path.join(spill_dir, '{}.{}'.format(name, index))
+                      for index in range(partitions)]
+        self.buffers = [[] for _ in range(partitions)]
+        self.buffered = 0
+
+    def add(self, hashes, rows):
+        """Add the hashes of rows.
+
+        :param hashes: row hashes.
+        :param rows: row numbers.
+        """
+        pairs = np.empty(len(hashes), dtype=_HASH_ROW)
+        pairs['hash'] = hashes
+        pairs['row'] = rows
+        self.add_pairs(pairs)
+
+    def add_pairs(self, pairs):
+        """Add (hash, row) pairs."""
+        owners = pairs['hash'] // self.divisor % np.uint64(self.partitions)
+        for index in np.unique(owners):
+            self.buffers[index].append(pairs[owners == index])
+        self.buffered += len(pairs)
+        if self.buffered > self.max_buffered:
+            self.spill()
+
+    def spill(self):
+        """Append the buffered pairs to the spill files."""
+        for path, buffer in zip(self.paths, self.buffers):
+            if buffer:
+                with open(path, 'ab') as handle:
+                    np.concatenate(buffer).tofile(handle)
+                del buffer[:]
+        self.buffered = 0
+
+    def size(self, index):
+        """Return the number of pairs of a partition."""
+        size = sum(len(pairs) for pairs in self.buffers[index])
+        if os.path.exists(self.paths[index]):
+            size += os.path.getsize(self.paths[index]) // _HASH_ROW.itemsize
+        return size
+
+    def can_split(self):
+        """Return whether the hashes have digits left to split on."""
+        return self.partitions ** (self.level + 2) <= 1 << 64
+
+    def split(self, index):
+        """Split a partition into partitions of the next level.
+
+        The partition is read max_buffered pairs at a time and its spill
+        file removed.
+        :param index: partition number.
+        :rtype: HashPartitions
+        """
+        parts = type(self)(
+            self.spill_dir, '{}.{}'.format(self.name, index),
+            self.partitions, self.max_buffered, self.level + 1)
+        for pairs in self.buffers[index]:
+            parts.add_pairs(pairs)
+        self.buffers[index] = []
+        path = self.paths[index]
+        if os.path.exists(path):
+            spilled = np.memmap(path, dtype=_HASH_ROW, mode='r')
+            for start in range(0, len(spilled), self.max_buffered):
+                parts.add_pairs(np.array(
+                    spilled[start:start + self.max_buffered]))
+            del spilled
+            os.remove(path)
+        return parts
+
+    def load(self, index):
+        """Return every pair of a partition.
+
+        :param index: partition number.
+        :rtype: numpy.ndarray
+        """
+        arrays = list(self.buffers[index])
+        if os.path.exists(self.paths[index]):
+            arrays.append(np.fromfile(self.paths[index], dtype=_HASH_ROW))
+        if not arrays:
+            return np.empty(0, dtype=_HASH_ROW)
+        return np.concatenate(arrays)
+
+
+def _diff_partitions(source_parts, target_parts, removed, added):
+    """Collect the row numbers of hashes found on one side only.
+
+    Partitions holding more pairs than max_buffered on either side are
+    split until they fit, so at most about max_buffered pairs per side
+    are loaded at once. Only pairs sharing one hash, duplicate rows,
+    cannot be split further.
+    :param removed: list receiving source row number arrays.
+    :param added: list receiving target row number arrays.
+    """
+    for index in range(source_parts.partitions):
+        if source_parts.can_split() and max(
+                source_parts.size(index),
+                target_parts.size(index)) > source_parts.max_buffered:
+            _diff_partitions(source_parts.split(index),
+                             target_parts.split(index), removed, added)
+            continue
+        source_pairs = source_parts.load(index)
+        target_pairs = target_parts.load(index)
+        removed.append(source_pairs['row'][
+            ~np.isin(source_pairs['hash'], target_pairs['hash'])])
+        added.append(target_pairs['row'][
+            ~np.isin(target_pairs['hash'], source_pairs['hash'])])
+
+
+def _partition_file(path, sep, chunksize, columns, partitions):
+    """Hash every row of a file into partitions.
+
+    Snapshots are partitioned by their precomputed hashes.
+    :return: partitions of the file.
+    :rtype: HashPartitions
+    """
+    if is_snapshot(path):
+        hashes = snapshot_hashes(path, columns)
+        for start in range(0, len(hashes), chunksize):
+            stop = min(start + chunksize, len(hashes))
+            partitions.add(hashes[start:stop], np.arange(start, stop))
+        return partitions
+    for chunk in read_chunks(path, sep, chunksize):
+        partitions.add(row_hashes(chunk, columns), chunk.index.values)
+    return partitions
+
+
+def _select_rows(path, sep, chunksize, rows):
+    """Yield the chunks of a file restricted to the given row numbers.
+
+    :param rows: sorted row numbers.
+    :rtype: generator
+    """
+    if is_snapshot(path):
+        table = _data_table(open_snapshot(path))
+        for start in range(0, len(rows), chunksize):
+            yield table.take(pa.array(rows[start:start + chunksize])) \
+                .to_pandas()
+        return
+    for chunk in read_chunks(path, sep, chunksize):
+        if chunk.empty:
+            continue
+        start = np.searchsorted(rows, chunk.index[0])
+        stop = np.searchsorted(rows, chunk.index[-1], side='right')
+        if stop > start:
+            yield chunk.loc[rows[start:stop]]
+
+
+def _write_chunks(sink, name, chunks):
+    """Write data frame chunks to a sink table.
+
+    :return: number of rows written.
+    :rtype: int
+    """
+    count = 0
+    for chunk in chunks:
+        sink.write(name, chunk)
+        count += len(chunk)
+    if not count:
+        # Every table is output, even without rows.
+        sink.write(name, pd.DataFrame())
+    return count
+
+
+def stream_diff(source, target, sink, source_sep=',', target_sep=',',
+                chunksize=CHUNK_SIZE, columns=None,
+                partitions=HASH_PARTITIONS):
+    """Diff two delimited files with memory bounded by chunksize.
+
+    Rows are hashed chunk by chunk into hash partitions that spill to
+    disk. Partitions of more than chunksize hashes are split further, so
+    whatever the file size the partitions diffed one at a time hold
+    about chunksize hashes per side, duplicate rows aside. The rows found
+    only on one side are read back and written to the 'removed' and
+    'added' tables of sink.
+    :param source: source csv, tsv or snapshot path.
+    :param target: target csv, tsv or snapshot path.
+    :param sink: DiffSink receiving the rows.
+    :param source_sep: source field separator.
+    :param target_sep: target field separator.
+    :param chunksize: rows read at once.
+    :param columns: (optional) columns identifying a row, defaults to all.
+    :param partitions: number of hash partitions.
+    :return: removed and added row counts.
+    :rtype: dict
+    """
+    kinds = set([hashed_from(source), hashed_from(target)]) - set([None])
+    if len(kinds) > 1:
+        # '10.0' parsed from xlsx never hashes like '10' read from csv.
+        raise ValueError(
+            "Cannot diff rows hashed from parsed values(xls, xlsx, hdf or "
+            "html snapshots) against csv/tsv text chunk by chunk")
+    spill_dir = tempfile.mkdtemp(prefix='imgqa_diff_')
+    try:
+        source_parts = _partition_file(
+            source, source_sep, chunksize, columns,
+            HashPartitions(spill_dir, 'source', partitions, chunksize))
+        target_parts = _partition_file(
+            target, target_sep, chunksize, columns,
+            HashPartitions(spill_dir, 'target', partitions, chunksize))
+        removed, added = [], []
+        _diff_partitions(source_parts, target_parts, removed, added)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    return {
+        'removed_rows': _write_chunks(sink, 'removed', _select_rows(
+            source, source_sep, chunksize,
+            np.sort(np.concatenate(removed)))),
+        'added_rows': _write_chunks(sink, 'added', _select_rows(
+            target, target_sep, chunksize, np.sort(np.concatenate(added)))),
+    }
+
+
+def changed_cells(old, new):
+    """Return where two aligned columns differ.
+
+    :param old: source column values.
+    :param new: target column values.
+    :return: boolean mask, True where the values differ and are not both
+        missing.
+    :rtype: numpy.ndarray
+    """
+    old = np.asarray(old)
+    new = np.asarray(new)
+    differ = np.asarray(old != new, dtype=bool)
+    # NaN != NaN, so differing cells missing on both sides are equal.
+    differ[differ] = ~(pd.isnull(old[differ]) & pd.isnull(new[differ]))
+    return differ
+
+
+def cell_diff(source, target, columns):
+    """Report cell changes between frames aligned on their index.
+
+    Change masks are computed column by column with array operations and
+    the 'source ---> target' strings are only built for changed cells.
+    :param source: source data frame.
+    :param target: target data frame.
+    :param columns: columns compared.
+    :return: source values, changed cells replaced by
+        'source ---> target', with a Yes/No 'has_change' column per row.
+    :rtype: data frame.
+    """
+    index = source.index.union(target.index)
+    # object columns keep integers intact on rows missing from one side.
+    before = source[columns].astype(object).reindex(index)
+    after = target[columns].astype(object).reindex(index)
+    report = before.copy()
+    has_change = np.zeros(len(index), dtype=bool)
+    for column in columns:
+        old = before[column].values
+        new = after[column].values
+        changed = changed_cells(old, new)
+        if changed.any():
+            values = report[column].values.copy()
+            values[changed] = ['{} ---> {}'.format(*pair) for pair in
+                               zip(old[changed], new[changed])]
+            report[column] = values
+            has_change |= changed
+    report['has_change'] = np.where(has_change, 'Yes', 'No')
+    return report
+
+
+def keyed_diff(source, target, keys):
+    """Classify rows as removed, added or modified by their key columns.
+
+    Rows are matched through an index on the key columns and compared
+    column by column with array operations, values missing on both
+    sides being equal. Only the columns present in both frames are
+    compared.
+    :param source: source data frame.
+    :param target: target data frame.
+    :param keys: columns identifying a row, unique within each frame.
+    :return: 'removed' and 'added' rows, 'modified' rows with source and
+        target values side by side and 'changes', the boolean change mask
+        of every modified row and compared column.
+    :rtype: dict
+    """
+    keys = list(keys)
+    source = source.set_index(keys)
+    target = target.set_index(keys)
+    for name, frame in (('source', source), ('target', target)):
+        if not frame.index.is_unique:
+            raise ValueError(
+                "Duplicate {} keys on columns {}".format(name, keys))
+    columns = [column for column in source.columns
+               if column in target.columns]
+    common = source.index.intersection(target.index)
+    before = source.reindex(common)[columns]
+    after = target.reindex(common)[columns]
+    changes = np.zeros((len(common), len(columns)), dtype=bool)
+    for position, column in enumerate(columns):
+        changes[:, position] = changed_cells(
+            before[column].values, after[column].values)
+    modified = changes.any(axis=1)
+    return {
+        'removed': source[~source.index.isin(target.index)].reset_index(),
+        'added': target[~target.index.isin(source.index)].reset_index(),
+        'modified': pd.concat(
+            [before[modified], after[modified]], axis='columns',
+            keys=['source', 'target']),
+        'changes': pd.DataFrame(changes[modified], columns=columns,
+                                index=common[modified]),
+    }
+
+
+def unique_prefix(out_dir, name='file_diff'):
+    """Return an output path prefix unique to this run.
+
+    :param out_dir: output directory.
+    :param name: file name prefix.
+    :return: out_dir/<name>_<timestamp>_<random id>
+    :rtype: str
+    """
+    return os.path.join(out_dir, '{}_{:%Y%m%d%H%M%S}_{}'.format(
+        name, datetime.now(), uuid.uuid4().hex[:8]))
+
+
+def _flatten(frame, index):
+    """Return a frame a flat file can hold.
+
+    Column levels are joined with '.' and the index, when kept, becomes
+    columns.
+    """
+    if isinstance(frame.columns, pd.MultiIndex):
+        frame = frame.copy()
+        frame.columns = ['.'.join(str(level) for level in column)
+                         for column in frame.columns]
+    return frame.reset_index() if index else frame
+
+
+class DiffSink(object):
+    """Destination of the tables of a diff, written chunk by chunk.
+
+    Subclasses implement write and close, so a diff can stream its
+    'removed', 'added'... tables wherever they are wanted.
+    """
+
+    def write(self, name, frame, index=False):
+        """Append a data frame chunk to a table.
+
+        :param name: table name.
+        :param frame: data frame chunk.
+        :param index: keep the index of frame.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Finish the output and return it.
+
+        :return: table name to output(path or data frame).
+        :rtype: dict
+        """
+        raise NotImplementedError
+
+
+class MemorySink(DiffSink):
+    """Keep the tables as data frames."""
+
+    def __init__(self):
+        """Start with no table."""
+        self.tables = {}
+
+    def write(self, name, frame, index=False):
+        """Append a data frame chunk to a table."""
+        self.tables.setdefault(name, []).append(
+            frame if index else frame.reset_index(drop=True))
+
+    def close(self):
+        """Return table name to data frame."""
+        return dict(
+            (name, chunks[0] if len(chunks) == 1 else pd.concat(
+                chunks, ignore_index=not isinstance(
+                    chunks[0].index, pd.MultiIndex)))
+            for name, chunks in self.tables.items())
+
+
+class ExcelSink(DiffSink):
+    """Write every table to a sheet of one xlsx workbook."""
+
+    def __init__(self, path):
+        """Write the workbook at path.
+
+        :param path: xlsx path.
+        """
+        self.path = path
+        self.writer = pd.ExcelWriter(path)
+        self.sheets = {}
+        self.rows = {}
+
+    def write(self, name, frame, index=False):
+        """Append a data frame chunk to a sheet."""
+        sheet = self.sheets.get(name)
+        if sheet is None:
+            sheet = self.sheets[name] = self.__sheet_name(name)
+        start = self.rows.get(name)
+        frame = _flatten(frame, False)
+        frame.to_excel(self.writer, sheet, index=index,
+                       header=start is None,
+                       startrow=0 if start is None else start)
+        self.rows[name] = (start or 1) + len(frame)
+
+    def close(self):
+        """Save the workbook and return table name to its path."""
+        self.writer.close()
+        return dict((name, self.path) for name in self.rows)
+
+    def __sheet_name(self, name):
+        """Return a sheet name unique in the workbook for a table.
+
+        Excel limits sheet names to 31 characters, compared regardless of
+        case, so long names are cut before their last word, the table
+        suffix('changed', 'removed'...), and numbered when still taken.
+        """
+        head, sep, suffix = name.rpartition(' ')
+        if not sep:
+            head, suffix = name, ''
+        suffix = (sep + suffix)[:31]
+        taken = set(sheet.lower() for sheet in self.sheets.values())
+        sheet = name if len(name) <= 31 else \
+            head[:31 - len(suffix)] + suffix
+        number = 1
+        while sheet.lower() in taken:
+            tag = ' ({})'.format(number)
+            sheet = head[:31 - len(suffix) - len(tag)] + tag + suffix
+            number += 1
+        return sheet
+
+
+class _FileSink(DiffSink):
+    """Write every table to its own prefix_<table>.<extn> file."""
+
+    extn = None
+
+    def __init__(self, prefix):
+        """Write the tables next to prefix.
+
+        :param prefix: path prefix of the files.
+        """
+        self.prefix = prefix
+        self.paths = {}
+
+    def write(self, name, frame, index=False):
+        """Append a data frame chunk to a table file."""
+        if name not in self.paths:
+            self.paths[name] = '{}_{}.{}'.format(self.prefix, name, self.extn)
+        self._append(name, self.paths[name], _flatten(frame, index))
+
+    def _append(self, name, path, frame):
+        """Append a flat data frame chunk to path."""
+        raise NotImplementedError
+
+    def close(self):
+        """Return table name to file path."""
+        return dict(self.paths)
+
+
+class CsvSink(_FileSink):
+    """Stream every table to a csv file."""
+
+    extn = 'csv'
+
+    def _append(self, name, path, frame):
+        """Append a flat data frame chunk to path."""
+        header = not os.path.exists(path)
+        with open(path, 'a' if not header else 'w') as handle:
+            frame.to_csv(handle, index=False, header=header)
+
+
+class JsonLinesSink(_FileSink):
+    """Stream every table to a json lines file, one record per row."""
+
+    extn = 'jsonl'
+
+    def _append(self, name, path, frame):
+        """Append a flat data frame chunk to path."""
+        if frame.empty:
+            open(path, 'a').close()
+            return
+        with open(path, 'a') as handle:
+            handle.write(frame.to_json(orient='records', lines=True)
+                         .rstrip('\n') + '\n')
+
+
+class ParquetSink(_FileSink):
+    """Stream every table to a parquet file, one row group per chunk."""
+
+    extn = 'parquet'
+
+    def __init__(self, prefix):
+        """Write the tables next to prefix, requires pyarrow."""
+        if pq is None:
+            raise ImportError("Parquet diff output requires pyarrow")
+        super(ParquetSink, self).__init__(prefix)
+        self.writers = {}
+
+    def _append(self, name, path, frame):
+        """Append a flat data frame chunk to path."""
+        writer = self.writers.get(name)
+        table = pa.Table.from_pandas(
+            frame, preserve_index=False,
+            schema=writer.schema if writer else None)
+        if writer is None:
+            writer = self.writers[name] = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+
+    def close(self):
+        """Close the parquet files and return table name to file path."""
+        for writer in self.writers.values():
+            writer.close()
+        return super(ParquetSink, self).close()
+
+
+SINKS = {'csv': CsvSink, 'jsonl': JsonLinesSink, 'parquet': ParquetSink}
+
+
+def make_sink(sink, out_dir):
+    """Return the DiffSink named sink, writing to a unique path.
+
+    :param sink: 'xlsx', 'csv', 'jsonl', 'parquet', 'memory' or a
+        DiffSink, returned as is.
+    :param out_dir: output directory of file sinks.
+    :rtype: DiffSink
+    """
+    if isinstance(sink, DiffSink):
+        return sink
+    if sink == 'memory':
+        return MemorySink()
+    if sink == 'xlsx':
+        return ExcelSink(unique_prefix(out_dir) + '.xlsx')
+    if sink in SINKS:
+        return SINKS[sink](unique_prefix(out_dir))
+    raise ValueError("Unknown diff sink '{}'".format(sink))
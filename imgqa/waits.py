@@ -0,0 +1,119 @@
+"""Conditions of the BrowserActions explicit waits.
+
+A condition is a callable taking the WebDriver and returning a true
+value once it is met, as WebDriverWait expects; its description names it
+in timeout messages and wait timings.
+"""
+from selenium.common import exceptions as selenium_exceptions
+from selenium.webdriver.support import expected_conditions as ec
+
+from imgqa.locator import as_locator
+
+# Exceptions of elements not found yet or replaced while waiting.
+IGNORED_EXCEPTIONS = (selenium_exceptions.NoSuchElementException,
+                      selenium_exceptions.StaleElementReferenceException)
+
+ELEMENT_STATES = {
+    'present': ec.presence_of_element_located,
+    'visible': ec.visibility_of_element_located,
+    'clickable': ec.element_to_be_clickable,
+}
+
+
+class Condition(object):
+    """Described WebDriverWait condition."""
+
+    def __init__(self, check, description):
+        """Create the condition.
+
+        :param check: callable taking the WebDriver, returning a true value
+            once the condition is met.
+        :param description: text naming the condition.
+        """
+        self.check = check
+        self.description = description
+
+    def __call__(self, driver):
+        """Return the result of the check, false until it is met."""
+        return self.check(driver)
+
+    def __str__(self):
+        """Return the description."""
+        return self.description
+
+
+def element(locator, state='present'):
+    """Return the condition of an element reaching a state.
+
+    :param locator: Locator or locator dictionary.
+    :param state: 'present', 'visible' or 'clickable'.
+    :return: condition returning the element.
+    :rtype: Condition
+    """
+    locator = as_locator(locator)
+    try:
+        check = ELEMENT_STATES[state]((locator.by, locator.value))
+    except KeyError:
+        raise AssertionError("Unknown element state '{}', expected one of "
+                             "{}".format(state, sorted(ELEMENT_STATES)))
+    return Condition(check, '{} {}'.format(locator, state))
+
+
+def text(locator, expected):
+    """Return the condition of an element text containing a text.
+
+    :param locator: Locator or locator dictionary.
+    :param expected: text the element text contains.
+    :return: condition returning the element.
+    :rtype: Condition
+    """
+    locator = as_locator(locator)
+
+    def check(driver):
+        found = driver.find_element(locator.by, locator.value)
+        return found if expected in found.text else False
+    return Condition(check, '{} text {!r}'.format(locator, expected))
+
+
+def count(locator, number, at_least=False):
+    """Return the condition of a locator matching a number of elements.
+
+    :param locator: Locator or locator dictionary.
+    :param number: number of elements.
+    :param at_least: also met by more elements.
+    :return: condition returning the elements.
+    :rtype: Condition
+    """
+    locator = as_locator(locator)
+
+    def check(driver):
+        found = driver.find_elements(locator.by, locator.value)
+        if len(found) == number or at_least and len(found) > number:
+            # An empty list is false, match zero elements with True.
+            return found or True
+        return False
+    return Condition(check, '{} count {}{}'.format(
+        locator, 'at least ' if at_least else '', number))
+
+
+def first_of(conditions):
+    """Return the condition of any of several conditions being met.
+
+    The conditions are checked in order at every poll.
+    :param conditions: conditions.
+    :return: condition returning (index of the condition met, its result).
+    :rtype: Condition
+    """
+    conditions = list(conditions)
+
+    def check(driver):
+        for index, condition in enumerate(conditions):
+            try:
+                result = condition(driver)
+            except IGNORED_EXCEPTIONS:
+                continue
+            if result:
+                return index, result
+        return False
+    return Condition(check, ' or '.join(
+        str(condition) for condition in conditions))